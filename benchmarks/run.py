@@ -0,0 +1,352 @@
+# load libraries
+import argparse
+import collections
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCHMARK_DIR)
+# the two halves of the project import their modules flat (import investor,
+# from lib_for_dqn import ...), so both folders go on the path
+sys.path.insert(0, os.path.join(ROOT, "dynamic_programming"))
+sys.path.insert(0, os.path.join(ROOT, "reinforcement"))
+
+SEED = 0
+DEFAULT_RESULTS = os.path.join(BENCHMARK_DIR, "results.json")
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+# a benchmark regresses when its best time is this much slower than the baseline's
+REGRESSION_THRESHOLD = 0.25
+
+SOLVER_METHODS = ("slsqp", "grid", "egm")
+SOLVER_GRID_SIZES = (15, 30, 60)
+UTILITY_CALLS = 2000
+ENV_STEPS = 20000
+REPLAY_CAPACITIES = (10**4, 10**5, 10**6)
+REPLAY_SAMPLES = 2000
+TRAINING_ITERATIONS = 500
+STARTUP_RUNS = 5
+
+# wall-clock budgets in seconds per start of a fresh interpreter, independent of the
+# baseline: a run fails when one of these starts slower than its budget. Before the heavy
+# imports were made lazy, importing lifecycle took about 2.9 s here
+STARTUP_BUDGETS = {
+    "startup/cli": 0.25,
+    "startup/lifecycle": 1.5,
+    "startup/evaluation": 0.5,
+}
+
+# name -> (prepare, repeats, unit). prepare(seed) does the untimed setup and returns a
+# function that runs the timed work and returns how many units it did
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name, repeats=5, unit="call"):
+    def register(prepare):
+        BENCHMARKS[name] = (prepare, repeats, unit)
+        return prepare
+
+    return register
+
+
+def _register_solver(method, grid_size):
+    # the grid spans the same log range as investor.WEALTH_GRID at every size
+    @benchmark("optimize_lifecycle/%s/%d" % (method, grid_size), repeats=3, unit="solve")
+    def prepare(seed):
+        import investor
+        import lifecycle
+
+        parameters = investor.make_parameters(
+            WEALTH_GRID=np.exp(np.linspace(-investor.BASE_INCOME * 600,
+                                           investor.BASE_INCOME * 300, grid_size)))
+
+        def run():
+            lifecycle.optimize_lifecycle(method=method, parameters=parameters)
+            return 1
+
+        return run
+
+
+for _method in SOLVER_METHODS:
+    for _grid_size in SOLVER_GRID_SIZES:
+        _register_solver(_method, _grid_size)
+
+
+@benchmark("epstein_zin_utility", unit="call")
+def prepare_utility(seed):
+    import investor
+    import lifecycle
+    from scipy.interpolate import PchipInterpolator
+
+    context = lifecycle.ModelContext()
+    # the terminal utility of optimize_lifecycle as the next-age utility
+    wealth_grid = context.wealth_grid
+    terminal_utility = ((1 - context.delta) * wealth_grid ** (1 - 1 / context.psi)) ** (
+        1 / (1 - 1 / context.psi))
+    future_utility_function = PchipInterpolator(wealth_grid, terminal_utility)
+    rng = np.random.default_rng(seed)
+    wealth = rng.choice(wealth_grid, UTILITY_CALLS)
+    points = np.column_stack((rng.uniform(0.05, 0.95, UTILITY_CALLS) * wealth,
+                              rng.uniform(context.min_equity, 1, UTILITY_CALLS)))
+    age = investor.END_AGE - 1
+
+    def run():
+        for x, w in zip(points, wealth):
+            lifecycle.epstein_zin_utility(x, w, age, future_utility_function, context)
+        return UTILITY_CALLS
+
+    return run
+
+
+def _run_env(env, actions):
+    env.reset()
+    for action in actions:
+        _, _, done, _ = env.step(action)
+        if done:
+            env.reset()
+    return len(actions)
+
+
+@benchmark("env_step/continuous", unit="step")
+def prepare_continuous_env(seed):
+    from lib_for_dqn import lifecycle as lifecycle_env
+
+    # flat profiles long enough for every age the env can reach
+    income_profile = np.where(np.arange(120) < 65, 0.5, 0.0)
+    mortality_profile = np.full(120, 0.01)
+    env = lifecycle_env.LifecycleEnv(income_profile, mortality_profile, seed=seed)
+    actions = np.random.default_rng(seed).uniform(-1, 1, (ENV_STEPS, 2)).astype(np.float32)
+    return lambda: _run_env(env, actions)
+
+
+@benchmark("env_step/discrete", unit="step")
+def prepare_discrete_env(seed):
+    from lib_for_dqn import lifecycle_discrete
+
+    env = lifecycle_discrete.LifecycleEnv()
+    rng = np.random.default_rng(seed)
+    # small consumptions, so most episodes run to the terminal age
+    actions = [{"equity_allocation": int(equity), "consumption": int(consumption)}
+               for equity, consumption in zip(rng.integers(0, 6, ENV_STEPS),
+                                              rng.integers(0, 80, ENV_STEPS))]
+    return lambda: _run_env(env, actions)
+
+
+def _register_replay(capacity):
+    @benchmark("replay_sample/%d" % capacity, unit="batch")
+    def prepare(seed):
+        import dqn
+        from lib_for_dqn import replay
+
+        # transitions shaped like the ones dqn.py stores
+        rng = np.random.default_rng(seed)
+        buffer = replay.ExperienceBuffer(capacity, seed=seed)
+        buffer.append_batch(
+            rng.random((capacity, 2), dtype=np.float32),
+            rng.integers(0, 190, (capacity, 2)),
+            rng.random(capacity, dtype=np.float32),
+            rng.random(capacity) < 0.01,
+            rng.random((capacity, 2), dtype=np.float32),
+        )
+
+        def run():
+            for _ in range(REPLAY_SAMPLES):
+                buffer.sample(dqn.BATCH_SIZE)
+            return REPLAY_SAMPLES
+
+        return run
+
+
+for _capacity in REPLAY_CAPACITIES:
+    _register_replay(_capacity)
+
+
+def _register_startup(name, command, cwd):
+    # STARTUP_RUNS fresh interpreters per repeat, so the best time is per start
+    @benchmark("startup/" + name, repeats=3, unit="start")
+    def prepare(seed):
+        def run():
+            for _ in range(STARTUP_RUNS):
+                subprocess.run([sys.executable, "-W", "ignore"] + command, cwd=cwd, check=True,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return STARTUP_RUNS
+
+        return run
+
+
+_register_startup("cli", [os.path.join(ROOT, "cli.py"), "--help"], ROOT)
+_register_startup("lifecycle", ["-c", "import lifecycle"], os.path.join(ROOT, "dynamic_programming"))
+_register_startup("evaluation", ["-c", "import evaluation"], os.path.join(ROOT, "dynamic_programming"))
+_register_startup("dqn", ["-c", "import dqn"], os.path.join(ROOT, "reinforcement"))
+
+
+@benchmark("dqn_training", repeats=3, unit="iteration")
+def prepare_training(seed):
+    # the single-process loop of dqn.py: one env step and one optimizer step per
+    # iteration, starting from a replay buffer filled with random play
+    import torch
+    import torch.optim as optim
+    import dqn
+    from lib_for_dqn import dqn_model, replay
+
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    env = dqn.make_env()
+    env.action_space.seed(seed)
+    branch_sizes = [env.action_space[key].n for key in dqn.ACTION_KEYS]
+    net = dqn_model.BranchingDQN(env.observation_space.low, env.observation_space.high, branch_sizes)
+    tgt_net = dqn_model.BranchingDQN(env.observation_space.low, env.observation_space.high, branch_sizes)
+    tgt_net.load_state_dict(net.state_dict())
+    buffer = replay.ExperienceBuffer(dqn.REPLAY_SIZE, seed=seed)
+    agent = dqn.make_agent([env], buffer)
+    while len(buffer) < dqn.REPLAY_START_SIZE:
+        dqn.play_steps(agent, net, epsilon=1.0)
+    optimizer = optim.Adam(net.parameters(), lr=dqn.LEARNING_RATE)
+
+    def run():
+        for iteration in range(TRAINING_ITERATIONS):
+            dqn.play_steps(agent, net, dqn.EPSILON_FINAL)
+            if iteration % dqn.SYNC_TARGET_FRAMES == 0:
+                tgt_net.load_state_dict(net.state_dict())
+            optimizer.zero_grad()
+            loss_t = dqn.calc_loss(buffer.sample(dqn.BATCH_SIZE), net, tgt_net)
+            loss_t.backward()
+            optimizer.step()
+        return TRAINING_ITERATIONS
+
+    return run
+
+
+def measure(name, repeats=None):
+    # the setup is redone with the same seed before every repeat, so all repeats time
+    # identical work; the best time is the one compared, the median is kept for reference
+    prepare, default_repeats, unit = BENCHMARKS[name]
+    timings = []
+    for _ in range(repeats or default_repeats):
+        run = prepare(SEED)
+        start = time.perf_counter()
+        units = run()
+        timings.append(time.perf_counter() - start)
+    best = min(timings)
+    result = {
+        "seconds": best,
+        "median_seconds": float(np.median(timings)),
+        "repeats": len(timings),
+        "units": units,
+        "unit": unit,
+        "per_second": units / best,
+    }
+    if name in STARTUP_BUDGETS:
+        result["budget"] = STARTUP_BUDGETS[name]
+    return result
+
+
+def over_budget(results):
+    # names whose time per unit is above their budget
+    return [name for name, result in results.items()
+            if "budget" in result and result["seconds"] / result["units"] > result["budget"]]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metadata():
+    versions = {"python": platform.python_version(), "numpy": np.__version__}
+    for module in ("scipy", "torch", "gym"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {
+        "commit": _git_commit(),
+        "machine": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "seed": SEED,
+        "versions": versions,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    # (name, ratio) for the benchmarks in both runs, and the names that regressed.
+    # ratio is the current best time over the baseline's
+    ratios = []
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["seconds"] / baseline[name]["seconds"]
+        ratios.append((name, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def save(path, results):
+    with open(path, "w") as f:
+        json.dump({"metadata": metadata(), "results": results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the solver, env, replay and training hot paths")
+    parser.add_argument("--filter", default=None,
+                        help="Only run the benchmarks whose name contains this string")
+    parser.add_argument("--repeats", type=int, default=None,
+                        help="Repeats of every benchmark, default is set per benchmark")
+    parser.add_argument("--output", default=DEFAULT_RESULTS,
+                        help="JSON file the results are written to, default=%s" % DEFAULT_RESULTS)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="JSON results to compare against, default=%s" % DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Relative slowdown counted as a regression, default=%.2f" % REGRESSION_THRESHOLD)
+    parser.add_argument("--update-baseline", default=False, action="store_true",
+                        help="Write the results to the baseline file as well")
+    parser.add_argument("--list", default=False, action="store_true", help="List the benchmarks and exit")
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter is None or args.filter in name]
+    if args.list:
+        print("\n".join(names))
+        sys.exit(0)
+
+    results = collections.OrderedDict()
+    for name in names:
+        results[name] = measure(name, args.repeats)
+        print("%-32s %10.4f s  %12.1f %s/s" % (
+            name, results[name]["seconds"], results[name]["per_second"], results[name]["unit"]),
+            flush=True)
+    save(args.output, results)
+    print("Results written to %s" % args.output)
+    failed = False
+    for name in over_budget(results):
+        print("%s takes %.3f s per start, over its budget of %.3f s" % (
+            name, results[name]["seconds"] / results[name]["units"], results[name]["budget"]))
+        failed = True
+
+    if args.update_baseline:
+        save(args.baseline, results)
+        print("Baseline written to %s" % args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        ratios, regressions = compare(results, baseline, args.threshold)
+        for name, ratio in ratios:
+            print("%-32s %6.2fx baseline%s" % (name, ratio, "  REGRESSION" if name in regressions else ""))
+        if regressions:
+            print("%d benchmark(s) slower than the baseline by more than %d%%" % (
+                len(regressions), round(args.threshold * 100)))
+            failed = True
+    else:
+        print("No baseline at %s, run with --update-baseline to create one" % args.baseline)
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,107 @@
+# load libraries
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DP_DIR = os.path.join(ROOT, "dynamic_programming")
+RL_DIR = os.path.join(ROOT, "reinforcement")
+
+# Entry point for short scheduled jobs. Only argparse is imported up front; numpy, scipy,
+# quantecon and torch are imported by the subcommand that needs them, so --help and
+# argument errors cost no more than starting the interpreter
+
+
+def _use(directory):
+    # the project folders import their modules flat (import investor, from lib_for_dqn
+    # import ...), as when a script is run from inside them
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+
+def solve(args):
+    _use(DP_DIR)
+    import lifecycle
+
+    start = time.perf_counter()
+    solution = lifecycle.optimize_lifecycle(
+        method=args.method, workers=args.workers, warm_start=args.warm_start,
+        adaptive=args.adaptive, ftol=args.ftol)
+    solution.save(args.output)
+    print("Solved on %d wealth points in %.2f s, %d objective evaluations, saved to %s" % (
+        len(solution.wealth_grid), time.perf_counter() - start, solution.evaluations.sum(), args.output))
+
+
+def train(args):
+    # dqn.py runs in its own interpreter, as if started from the command line: its actor
+    # processes are spawned and have to find their functions in the main script
+    return subprocess.call([sys.executable, os.path.join(RL_DIR, "dqn.py")] + args.dqn_args)
+
+
+def evaluate(args):
+    _use(DP_DIR)
+    import evaluation
+    import lifecycle
+
+    solution = lifecycle.LifecycleSolution.load(args.solution)
+    shocks = evaluation.draw_shocks(args.agents, seed=args.seed)
+    result = evaluation.simulate(evaluation.dp_policy(solution), shocks)
+    print("Welfare %.6g (%.6g, %.6g)" % ((result.welfare,) + tuple(result.welfare_ci)))
+    print("Certainty equivalent %.6g (%.6g, %.6g)" % (
+        (result.certainty_equivalent,) + tuple(result.certainty_equivalent_ci)))
+    if result.ruined.any():
+        print("Consumption below the utility floor in %d agent-years" % result.ruined.sum())
+    if args.csv is not None:
+        result.to_frame().to_csv(args.csv)
+        print("Statistics by age written to %s" % args.csv)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve, train and evaluate lifecycle policies")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    solve_parser = commands.add_parser("solve", help="Solve the lifecycle problem with dynamic programming")
+    solve_parser.add_argument("--method", default="slsqp", choices=["slsqp", "grid", "egm"],
+                              help="Solver of each age, default=slsqp")
+    solve_parser.add_argument("--workers", type=int, default=None,
+                              help="Processes sharing the wealth grid, default is one")
+    solve_parser.add_argument("--warm-start", default=False, action="store_true",
+                              help="Seed every SLSQP cell from the age above")
+    solve_parser.add_argument("--adaptive", default=False, action="store_true",
+                              help="Refine the wealth grid where the solution is poorly resolved, slsqp only")
+    # the library keeps SLSQP's absolute tolerance when ftol is None, which is too loose for
+    # the solutions saved from here
+    solve_parser.add_argument("--ftol", type=float, default=1e-8,
+                              help="SLSQP tolerance relative to wealth, slsqp only, default=1e-8")
+    solve_parser.add_argument("--output", default="lifecycle_solution.npz",
+                              help="Where the solution is saved, default=lifecycle_solution.npz")
+    solve_parser.set_defaults(handler=solve)
+
+    train_parser = commands.add_parser(
+        "train", help="Train the DQN agent, the arguments go to dqn.py",
+        description="Every argument is passed on to reinforcement/dqn.py, e.g. train --envs 8 --resume",
+        add_help=False)
+    train_parser.set_defaults(handler=train)
+
+    evaluate_parser = commands.add_parser("evaluate", help="Simulate a saved solution over a cohort of agents")
+    evaluate_parser.add_argument("solution", help="Solution saved by solve")
+    evaluate_parser.add_argument("--agents", type=int, default=100000,
+                                 help="Number of simulated agents, default=100000")
+    evaluate_parser.add_argument("--seed", type=int, default=0, help="Seed of the shocks, default=0")
+    evaluate_parser.add_argument("--csv", default=None, help="Write the statistics by age to this file")
+    evaluate_parser.set_defaults(handler=evaluate)
+
+    # the arguments solve and evaluate don't know are errors, those of train are dqn.py's
+    args, extra = parser.parse_known_args(argv)
+    if args.command != "train" and extra:
+        parser.error("unrecognized arguments: %s" % " ".join(extra))
+    if args.command == "solve" and args.adaptive and args.method != "slsqp":
+        parser.error("--adaptive only refines slsqp solves")
+    args.dqn_args = extra
+    return args.handler(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+# load libraries
+import collections
+import numpy as np
+import investor
+
+
+# Return and survival draws for every age (rows) and simulated agent (columns). Every
+# policy evaluated on the same Shocks sees exactly the same market paths and deaths, so
+# the differences between policies aren't simulation noise
+Shocks = collections.namedtuple('Shocks', field_names=['ages', 'risky_return', 'survival_draw'])
+
+
+def draw_shocks(n_agents, parameters=investor, seed=None, dtype=np.float32):
+    # float32 keeps 10^6 agents over 80 ages at about 650MB for both matrices
+    ages = np.asarray(parameters.AGE_LEVELS)
+    rng = np.random.default_rng(seed)
+    # the dp quadrature passes RISK_ASSET_VOLATILITY to qnwnorm as the variance, so I
+    # draw log returns from the same distribution the policies were optimised for
+    risky_return = rng.normal(
+        parameters.RISK_ASSET_AVERAGE_RETURN,
+        np.sqrt(parameters.RISK_ASSET_VOLATILITY),
+        (len(ages), n_agents),
+    ).astype(dtype)
+    survival_draw = rng.random((len(ages), n_agents), dtype=dtype)
+    return Shocks(ages, risky_return, survival_draw)
+
+
+def dp_policy(solution):
+    # policy from a lifecycle.LifecycleSolution: consumption share and equity share are
+    # interpolated linearly on the wealth grid, for all agents of an age at once, and
+    # held constant beyond the ends of the grid
+    def policy(age, wealth):
+        row = solution.row(age)
+        consumption_share = np.interp(wealth, solution.wealth_grid, solution.consumption_policy[row])
+        equity = np.interp(wealth, solution.wealth_grid, solution.equity_policy[row])
+        return consumption_share * wealth, equity
+
+    return policy
+
+
+def lifecycle_env_decision(wealth_scale):
+    # decision for the two actions in [-1, 1] of reinforcement/lib_for_dqn/lifecycle.LifecycleEnv,
+    # read as that env reads them: the equity share and the amount consumed, in the env's
+    # units. wealth_scale is the env wealth per unit of wealth here (the env starts with
+    # wealth 1 on the income profile it was given, the income here starts at BASE_INCOME),
+    # so there is no default
+    def decision(actions, wealth):
+        equity = (actions[:, 0] + 1) / 2
+        consumption = (actions[:, 1] + 1) / 2 / wealth_scale
+        return consumption, equity
+
+    return decision
+
+
+def action_policy(act, decision):
+    # policy from any act(age, wealth) that returns the actions of all the agents as an
+    # (agents, 2) array; decision(actions, wealth) turns them into consumption and equity
+    def policy(age, wealth):
+        return decision(np.asarray(act(age, wealth)), wealth)
+
+    return policy
+
+
+def torch_policy(net, decision, wealth_scale=1.0, batch_size=65536, device="cpu"):
+    # policy from a torch network that maps (age, wealth * wealth_scale) rows to an
+    # (agents, 2) action tensor; decision turns the actions into consumption and equity.
+    # The agents are fed in large batches
+    import torch
+
+    def act(age, wealth):
+        observations = np.empty((len(wealth), 2), dtype=np.float32)
+        observations[:, 0] = age
+        observations[:, 1] = wealth * wealth_scale
+        actions = np.empty((len(wealth), 2), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(wealth), batch_size):
+                batch = torch.from_numpy(observations[start:start + batch_size]).to(device)
+                actions[start:start + batch_size] = net(batch).cpu().numpy()
+        return actions
+
+    return action_policy(act, decision)
+
+
+def stable_baselines_policy(model, wealth_scale, deterministic=True):
+    # policy from a stable-baselines3 model (e.g. the PPO agent) trained on
+    # reinforcement/lib_for_dqn/lifecycle.LifecycleEnv: observations are (age, wealth) in
+    # the env's units and model.predict returns (actions, states)
+    def act(age, wealth):
+        observations = np.empty((len(wealth), 2), dtype=np.float32)
+        observations[:, 0] = age
+        observations[:, 1] = wealth * wealth_scale
+        actions, _ = model.predict(observations, deterministic=deterministic)
+        return actions
+
+    return action_policy(act, lifecycle_env_decision(wealth_scale))
+
+
+def branching_dqn_policy(net, env, parameters=investor, wealth_scale=None, batch_size=65536,
+                         device="cpu"):
+    # policy from the dqn_model.BranchingDQN that dqn.py trains on
+    # reinforcement/lib_for_dqn/lifecycle_discrete.LifecycleEnv (pass that env, which needs
+    # reinforcement/ on sys.path as in cli.py). The agents are observed as the env observes
+    # them, (age, wealth bucket) in the order of wrappers.DictToVector, and every branch
+    # takes its best action: equity index / EQUITY_STEP and consumption index +
+    # CONSUMPTION_OFFSET in env units. wealth_scale defaults to the ratio of the starting
+    # incomes, env.starting_income / BASE_INCOME
+    import torch
+    from lib_for_dqn import tabular
+
+    if wealth_scale is None:
+        wealth_scale = env.starting_income / parameters.BASE_INCOME
+    keys = list(env.observation_space.spaces.keys())
+
+    def policy(age, wealth):
+        # the bucketing of the env's step
+        buckets = (wealth * wealth_scale / (env.max_wealth + 1) * env.wealth_buckets).astype(np.int64)
+        buckets = np.minimum(buckets, env.wealth_buckets - 1)
+        observations = np.empty((len(wealth), len(keys)), dtype=np.float32)
+        observations[:, keys.index("age")] = age
+        observations[:, keys.index("wealth_bucket")] = buckets
+        equity_index = np.empty(len(wealth), dtype=np.int64)
+        consumption_index = np.empty(len(wealth), dtype=np.int64)
+        with torch.inference_mode():
+            for start in range(0, len(wealth), batch_size):
+                batch = torch.from_numpy(observations[start:start + batch_size]).to(device)
+                q_equity, q_consumption = net(batch)
+                equity_index[start:start + batch_size] = q_equity.argmax(dim=1).cpu().numpy()
+                consumption_index[start:start + batch_size] = q_consumption.argmax(dim=1).cpu().numpy()
+        equity = equity_index / tabular.EQUITY_STEP
+        consumption = (consumption_index + tabular.CONSUMPTION_OFFSET) / wealth_scale
+        return consumption, equity
+
+    return policy
+
+
+class EvaluationResult:
+    # age x statistic arrays from simulate(), plus the welfare of the whole population.
+    # Consumption and wealth statistics are over the agents alive at each age
+    def __init__(self, ages):
+        self.ages = np.asarray(ages)
+        shape = len(self.ages)
+        self.alive = np.zeros(shape, dtype=int)
+        self.consumption_mean = np.zeros(shape)
+        self.consumption_ci = np.zeros((shape, 2))
+        self.consumption_quantiles = np.zeros((shape, 3))
+        self.wealth_mean = np.zeros(shape)
+        self.equity_mean = np.zeros(shape)
+        self.ruined = np.zeros(shape, dtype=int)
+        self.welfare = 0.0
+        self.welfare_ci = (0.0, 0.0)
+        self.certainty_equivalent = 0.0
+        self.certainty_equivalent_ci = (0.0, 0.0)
+
+    def to_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame(
+            {
+                "alive": self.alive,
+                "consumption_mean": self.consumption_mean,
+                "consumption_ci_low": self.consumption_ci[:, 0],
+                "consumption_ci_high": self.consumption_ci[:, 1],
+                "consumption_p05": self.consumption_quantiles[:, 0],
+                "consumption_median": self.consumption_quantiles[:, 1],
+                "consumption_p95": self.consumption_quantiles[:, 2],
+                "wealth_mean": self.wealth_mean,
+                "equity_mean": self.equity_mean,
+                "ruined": self.ruined,
+            },
+            index=self.ages,
+        )
+
+
+def _mean_ci(values, z):
+    mean = values.mean()
+    half_width = z * values.std(ddof=1) / np.sqrt(len(values)) if len(values) > 1 else 0.0
+    return mean, (mean - half_width, mean + half_width)
+
+
+def simulate(policy, shocks, parameters=investor, initial_wealth=None, z=1.96, consumption_floor=1e-6):
+    # simulate every agent of shocks through all ages under policy(age, wealth), which
+    # returns consumption and equity share arrays. Welfare is the expected discounted
+    # CRRA utility of consumption with the investor's DELTA and GAMMA, counted while the
+    # agent is alive; the certainty equivalent is the constant consumption with the same
+    # welfare. Confidence intervals are normal at z standard errors.
+    # An agent who consumes everything has no wealth after retirement, and u(0) is -inf
+    # for GAMMA > 1, so utility is taken at consumption_floor at least and the living
+    # agents below the floor are counted in result.ruined
+    n_agents = shocks.risky_return.shape[1]
+    if initial_wealth is None:
+        # I start everyone with one year of income
+        initial_wealth = parameters.INCOME[shocks.ages[0]]
+    wealth = np.full(n_agents, initial_wealth, dtype=float)
+    alive = np.ones(n_agents, dtype=bool)
+    lifetime_utility = np.zeros(n_agents)
+    discount = 0.0
+    gamma = parameters.GAMMA
+    result = EvaluationResult(shocks.ages)
+
+    for step, age in enumerate(shocks.ages):
+        consumption, equity = policy(age, wealth)
+        consumption = np.clip(consumption, 0, wealth)
+        equity = np.clip(equity, 0, 1)
+        floored = np.maximum(consumption[alive], consumption_floor)
+        lifetime_utility[alive] += parameters.DELTA ** step * floored ** (1 - gamma) / (1 - gamma)
+        # the horizon for the certainty equivalent, weighted by survival the same way
+        discount += parameters.DELTA ** step * alive.mean()
+
+        living_consumption = consumption[alive]
+        result.alive[step] = alive.sum()
+        result.ruined[step] = (consumption[alive] < consumption_floor).sum()
+        if len(living_consumption):
+            result.consumption_mean[step], result.consumption_ci[step] = _mean_ci(living_consumption, z)
+            result.consumption_quantiles[step] = np.percentile(living_consumption, [5, 50, 95])
+            result.wealth_mean[step] = wealth[alive].mean()
+            result.equity_mean[step] = equity[alive].mean()
+
+        # same transition as the dp objective: income of this age plus the invested savings
+        growth = np.exp(equity * shocks.risky_return[step] + (1 - equity) * parameters.RISK_FREE_RETURN)
+        wealth = parameters.INCOME[age] + (wealth - consumption) * growth
+        alive &= shocks.survival_draw[step] < parameters.SURVIVAL_PROBABILITY[age]
+
+    result.welfare, result.welfare_ci = _mean_ci(lifetime_utility, z)
+    # u(ce) * discount = welfare, and the mapping is increasing so the interval carries over
+    def certainty_equivalent(welfare):
+        return (welfare * (1 - gamma) / discount) ** (1 / (1 - gamma))
+
+    result.certainty_equivalent = certainty_equivalent(result.welfare)
+    result.certainty_equivalent_ci = tuple(certainty_equivalent(value) for value in result.welfare_ci)
+    return result
@@ -1,3 +1,4 @@
+import collections
 import numpy as np
 
 # Hyperparameters
@@ -22,3 +23,46 @@ RISK_ASSET_VOLATILITY = 0.157
 RISK_FREE_RETURN = 0.005
 
 
+
+
+# Immutable copy of the parameters above, so a sweep can solve many configurations
+# without editing this module. The field names match the globals, so a parameters
+# object can be used wherever the investor module is
+InvestorParameters = collections.namedtuple('InvestorParameters', field_names=[
+    'START_AGE', 'END_AGE', 'RETIREMENT_AGE', 'SURVIVAL_PROBABILITY', 'BASE_INCOME',
+    'INCREASE', 'INCOME', 'AGE_LEVELS', 'WEALTH_GRID', 'DELTA', 'GAMMA', 'PSI', 'MIN_EQUITY',
+    'RISK_ASSET_AVERAGE_RETURN', 'RISK_ASSET_VOLATILITY', 'RISK_FREE_RETURN'])
+
+
+def make_parameters(**overrides):
+    # anything not overridden comes from the globals above; the income path, survival
+    # probabilities, age levels, wealth grid and PSI are rebuilt from the overridden
+    # values unless they are given explicitly
+    values = {name: globals()[name] for name in InvestorParameters._fields}
+    values.update(overrides)
+    start_age, end_age = values['START_AGE'], values['END_AGE']
+    retirement_age = values['RETIREMENT_AGE']
+    if 'SURVIVAL_PROBABILITY' not in overrides:
+        values['SURVIVAL_PROBABILITY'] = [0.99] * retirement_age + [0.8] * (end_age - retirement_age)
+    if 'INCOME' not in overrides:
+        values['INCOME'] = [values['BASE_INCOME'] * (1.0 + values['INCREASE']) ** (n - 1)
+                            for n in range(1, retirement_age + 1)] + [0.0] * (end_age - retirement_age)
+    if 'AGE_LEVELS' not in overrides:
+        values['AGE_LEVELS'] = list(range(start_age, end_age))
+    if 'WEALTH_GRID' not in overrides:
+        values['WEALTH_GRID'] = np.exp(np.linspace(-values['BASE_INCOME'] * 600,
+                                                   values['BASE_INCOME'] * 300, 30))
+    if 'PSI' not in overrides:
+        values['PSI'] = 1 / values['GAMMA']
+    # plain ints and floats, so GAMMA=4 and GAMMA=4.0 (or np.float64(4)) are the same
+    # configuration and hash the same in a sweep
+    for name in ('START_AGE', 'END_AGE', 'RETIREMENT_AGE'):
+        values[name] = int(values[name])
+    for name in ('BASE_INCOME', 'INCREASE', 'DELTA', 'GAMMA', 'PSI', 'MIN_EQUITY',
+                 'RISK_ASSET_AVERAGE_RETURN', 'RISK_ASSET_VOLATILITY', 'RISK_FREE_RETURN'):
+        values[name] = float(values[name])
+    # tuples, so the parameters are hashable and can't be changed in place
+    for name in ('SURVIVAL_PROBABILITY', 'INCOME', 'WEALTH_GRID'):
+        values[name] = tuple(float(value) for value in values[name])
+    values['AGE_LEVELS'] = tuple(int(age) for age in values['AGE_LEVELS'])
+    return InvestorParameters(**values)
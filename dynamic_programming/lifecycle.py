@@ -1,98 +1,617 @@
 # load libraries
-import pandas as pd
 import numpy as np
+import multiprocessing
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 from scipy.optimize import minimize
-from scipy.interpolate import PchipInterpolator
+from scipy.interpolate import PchipInterpolator, PPoly
 import investor
-import quantecon
-import matplotlib.pyplot as plt
 
 
-def epstein_zin_utility(x, wealth, age, future_utility_function):
-    # here I create a list of returns using numerical integration
-    risky_ret, risky_prob = quantecon.quad.qnwnorm(
-        n=10,
-        mu=investor.RISK_ASSET_AVERAGE_RETURN,
-        sig2=investor.RISK_ASSET_VOLATILITY,
-    )
-    # here I compute the return of the portfolio
-    total_return = x[1] * risky_ret + (1 - x[1]) * investor.RISK_FREE_RETURN
+class ModelContext:
+    # everything the objective needs that doesn't change during a solve, built once from
+    # the investor parameters instead of on every objective evaluation
+    def __init__(self, parameters=investor, quadrature_nodes=10):
+        # quantecon (and numba behind it) takes most of the import time of this module,
+        # and only the quadrature needs it
+        import quantecon
+
+        # here I create a list of returns using numerical integration
+        risky_ret, risky_prob = quantecon.quad.qnwnorm(
+            n=quadrature_nodes,
+            mu=parameters.RISK_ASSET_AVERAGE_RETURN,
+            sig2=parameters.RISK_ASSET_VOLATILITY,
+        )
+        self.quadrature_nodes = quadrature_nodes
+        self.risky_return = risky_ret
+        self.risky_probability = risky_prob
+        self.risk_free_return = parameters.RISK_FREE_RETURN
+        # lists indexed by age, as in investor
+        self.income = np.asarray(parameters.INCOME, dtype=float)
+        self.survival_probability = np.asarray(parameters.SURVIVAL_PROBABILITY, dtype=float)
+        self.wealth_grid = np.asarray(parameters.WEALTH_GRID, dtype=float)
+        self.age_levels = list(parameters.AGE_LEVELS)
+        self.end_age = parameters.END_AGE
+        self.min_equity = parameters.MIN_EQUITY
+        self.gamma = parameters.GAMMA
+        self.delta = parameters.DELTA
+        self.psi = parameters.PSI
+        self._growth_tables = {}
+
+    def portfolio_growth(self, equity):
+        # gross portfolio return for every quadrature node, on a new last axis
+        equity = np.asarray(equity, dtype=float)[..., np.newaxis]
+        return np.exp(equity * self.risky_return + (1 - equity) * self.risk_free_return)
+
+    def growth_table(self, equity_levels):
+        # the lattice solver uses the same equity levels at every age, so I keep the table
+        key = (len(equity_levels), equity_levels[0], equity_levels[-1])
+        if key not in self._growth_tables:
+            self._growth_tables[key] = self.portfolio_growth(equity_levels)
+        return self._growth_tables[key]
+
+
+def _expectation(values, weights):
+    # sum over the quadrature nodes on the last axis. np.dot picks its summation order
+    # from the shape of the whole array, so a wealth point could come out differently
+    # depending on how many others it is solved with; a row-wise sum doesn't, which keeps
+    # the results the same for any number of workers
+    return (values * weights).sum(axis=-1)
+
+
+def _epstein_zin_value(consumption, growth, wealth, age, future_utility_function, context):
+    # consumption and wealth broadcast together, growth has the quadrature nodes on its
+    # last axis
+    consumption = np.asarray(consumption, dtype=float)
+    wealth = np.asarray(wealth, dtype=float)
     # I compute my expected new wealth given my investment decision and my consumption decision
-    new_wealth = investor.INCOME[age] + (wealth - x[0]) * np.exp(total_return)
-    # I need to add the bequest motive
-    expected_future_utility = np.dot(
-        risky_prob,
-        investor.SURVIVAL_PROBABILITY[age]
-        * future_utility_function(new_wealth) ** (1 - investor.GAMMA),
-    )
+    new_wealth = context.income[age] + (wealth - consumption)[..., np.newaxis] * growth
+    # a global search would otherwise exploit the interpolator extrapolating to negative
+    # utility below the grid, which the clamp on the expectation turns into a reward
+    future_utility = np.maximum(future_utility_function(new_wealth), 0)
+    # I need to add the bequest motive. A clamped node is 0 ** (1 - gamma) = inf, as it
+    # was before the clamp for utilities at 0, so only the warning is silenced
+    with np.errstate(divide="ignore"):
+        expected_future_utility = _expectation(
+            context.survival_probability[age] * future_utility ** (1 - context.gamma),
+            context.risky_probability,
+        )
     # lastly I can compute the value function using epstein-zin
     value = np.maximum(
         (
-            ((1 - investor.DELTA) * np.maximum(x[0], 1e-20) ** (1 - 1 / investor.PSI))
+            ((1 - context.delta) * np.maximum(consumption, 1e-20) ** (1 - 1 / context.psi))
             + (
-                (investor.DELTA * np.maximum(expected_future_utility, 1e-20))
-                ** ((1 - 1 / investor.PSI) / (1 - investor.GAMMA))
+                (context.delta * np.maximum(expected_future_utility, 1e-20))
+                ** ((1 - 1 / context.psi) / (1 - context.gamma))
             )
         )
-        ** (1 / (1 - 1 / investor.PSI)),
+        ** (1 / (1 - 1 / context.psi)),
         1e-20,
     )
 
     return value
 
 
-def optimize_lifecycle():
-    wealth_vector = investor.WEALTH_GRID
-    consumption_policy = pd.DataFrame(
-        np.zeros((len(investor.AGE_LEVELS), len(wealth_vector))),
-        index=investor.AGE_LEVELS,
-        columns=wealth_vector,
+def epstein_zin_utility(x, wealth, age, future_utility_function, context=None):
+    # x is (consumption, equity share). Without a context the quadrature is rebuilt
+    # from investor on every call
+    if context is None:
+        context = ModelContext()
+    return _epstein_zin_value(
+        x[0], context.portfolio_growth(x[1]), wealth, age, future_utility_function, context
+    )
+
+
+def epstein_zin_utility_and_gradient(x, wealth, age, future_utility_function, context=None,
+                                     future_utility_derivative=None):
+    # value of epstein_zin_utility and its gradient with respect to (consumption, equity
+    # share) in one pass, so SLSQP doesn't need finite differences
+    if context is None:
+        context = ModelContext()
+    if future_utility_derivative is None:
+        future_utility_derivative = future_utility_function.derivative()
+    consumption, equity = x[0], x[1]
+    rho = 1 - 1 / context.psi
+    theta = rho / (1 - context.gamma)
+    growth = context.portfolio_growth(equity)
+    new_wealth = context.income[age] + (wealth - consumption) * growth
+    future_utility = future_utility_function(new_wealth)
+    alive = future_utility > 0
+    future_utility = np.where(alive, future_utility, 0)
+    # chain rule through future_utility ** (1 - gamma); the clamped nodes have no slope
+    weights = context.risky_probability * context.survival_probability[age]
+    marginal = np.where(
+        alive,
+        (1 - context.gamma)
+        * np.where(alive, future_utility, 1) ** -context.gamma
+        * future_utility_derivative(new_wealth),
+        0,
     )
-    equity_policy = pd.DataFrame(
-        np.zeros((len(investor.AGE_LEVELS), len(wealth_vector))),
-        index=investor.AGE_LEVELS,
-        columns=wealth_vector,
+    expected_future_utility = np.dot(weights, future_utility ** (1 - context.gamma))
+    expected_gradient = np.array([
+        np.dot(weights, marginal * -growth),
+        np.dot(weights, marginal * (wealth - consumption) * growth
+               * (context.risky_return - context.risk_free_return)),
+    ])
+    if expected_future_utility <= 1e-20:
+        expected_future_utility = 1e-20
+        expected_gradient = np.zeros(2)
+    consumption_gradient = np.array([(1 - context.delta) * rho, 0.0])
+    if consumption <= 1e-20:
+        consumption = 1e-20
+        consumption_gradient = np.zeros(2)
+    inner = (
+        (1 - context.delta) * consumption ** rho
+        + (context.delta * expected_future_utility) ** theta
     )
-    utility_result = pd.DataFrame(
-        np.zeros((len(investor.AGE_LEVELS), len(wealth_vector))),
-        index=investor.AGE_LEVELS,
-        columns=wealth_vector,
+    inner_gradient = (
+        consumption_gradient * consumption ** (rho - 1)
+        + theta * context.delta * (context.delta * expected_future_utility) ** (theta - 1)
+        * expected_gradient
     )
+    value = inner ** (1 / rho)
+    if value <= 1e-20:
+        return 1e-20, np.zeros(2)
+    return value, inner ** (1 / rho - 1) / rho * inner_gradient
+
+
+def epstein_zin_utility_vectorized(consumption, equity, wealth, age, future_utility_function,
+                                   context=None):
+    # same objective as epstein_zin_utility, but consumption, equity and wealth can be
+    # arrays that broadcast together, so I can evaluate a whole lattice of choices at once
+    if context is None:
+        context = ModelContext()
+    return _epstein_zin_value(
+        consumption, context.portfolio_growth(equity), wealth, age, future_utility_function,
+        context,
+    )
+
+
+def _solve_age_grid(wealth_vector, current_age, future_utility_function, context,
+                    consumption_points, equity_points, refine_steps, starts=3):
+    # first I evaluate every wealth point over a (consumption share x equity share) lattice
+    share_levels = np.linspace(0, 1, consumption_points)
+    equity_levels = np.linspace(context.min_equity, 1, equity_points)
+    values = _epstein_zin_value(
+        share_levels[np.newaxis, :, np.newaxis] * wealth_vector[:, np.newaxis, np.newaxis],
+        context.growth_table(equity_levels)[np.newaxis, np.newaxis, :, :],
+        wealth_vector[:, np.newaxis, np.newaxis],
+        current_age,
+        future_utility_function,
+        context,
+    ).reshape(len(wealth_vector), -1)
+    # the objective is not always unimodal in the equity share, so I refine around the
+    # best few lattice cells of every wealth point and keep the best one at the end
+    starts = min(starts, values.shape[1])
+    best = np.argsort(-values, axis=1)[:, :starts]
+    share_index, equity_index = np.unravel_index(best, (consumption_points, equity_points))
+    share = share_levels[share_index].ravel()
+    equity = equity_levels[equity_index].ravel()
+    utility = np.take_along_axis(values, best, axis=1).ravel()
+    wealth = np.repeat(wealth_vector, starts)
+
+    # then I zoom in around every start at the same time with a 3 x 3 pattern whose
+    # spacing halves at each step. The current point is always a candidate, so the
+    # refinement can only improve the objective
+    share_step = 1 / (consumption_points - 1)
+    equity_step = (1 - context.min_equity) / (equity_points - 1)
+    offsets = np.array([-1.0, 0.0, 1.0])
+    rows = np.arange(len(wealth))
+    for _ in range(refine_steps):
+        share_candidates = np.clip(share[:, np.newaxis] + offsets * share_step, 0, 1)
+        equity_candidates = np.clip(
+            equity[:, np.newaxis] + offsets * equity_step, context.min_equity, 1
+        )
+        values = epstein_zin_utility_vectorized(
+            share_candidates[:, :, np.newaxis] * wealth[:, np.newaxis, np.newaxis],
+            equity_candidates[:, np.newaxis, :],
+            wealth[:, np.newaxis, np.newaxis],
+            current_age,
+            future_utility_function,
+            context,
+        ).reshape(len(wealth), -1)
+        # ties go to the centre so that flat directions don't drift
+        values[:, 4] = np.maximum(values[:, 4], utility)
+        best = values.argmax(axis=1)
+        best = np.where(values[rows, best] > values[:, 4], best, 4)
+        share_index, equity_index = np.unravel_index(best, (len(offsets), len(offsets)))
+        share = share_candidates[rows, share_index]
+        equity = equity_candidates[rows, equity_index]
+        utility = values[rows, best]
+        share_step /= 2
+        equity_step /= 2
+
+    best = utility.reshape(len(wealth_vector), starts).argmax(axis=1)
+    pick = np.arange(len(wealth_vector)) * starts + best
+    iterations = np.full(len(wealth_vector), refine_steps)
+    evaluations = np.full(
+        len(wealth_vector), consumption_points * equity_points + starts * 9 * refine_steps
+    )
+    return share[pick] * wealth_vector, equity[pick], utility[pick], iterations, evaluations
+
+
+class LifecycleSolution:
+    # age x wealth arrays the solver writes into directly. Rows are the ages from
+    # AGE_LEVELS followed by END_AGE, columns follow wealth_grid; consumption_policy is
+    # the share of wealth consumed
+    def __init__(self, ages, wealth_grid):
+        self.ages = np.asarray(ages)
+        self.wealth_grid = np.asarray(wealth_grid, dtype=float)
+        shape = (len(self.ages), len(self.wealth_grid))
+        self.consumption_policy = np.zeros(shape)
+        self.equity_policy = np.zeros(shape)
+        self.utility_result = np.zeros(shape)
+        # optimizer iterations and objective evaluations spent on every cell
+        self.iterations = np.zeros(shape, dtype=int)
+        self.evaluations = np.zeros(shape, dtype=int)
+        # (cells solved, evaluations) of every adaptive refinement level
+        self.levels = np.zeros((0, 2), dtype=int)
+
+    def __iter__(self):
+        # so that the old consumption_policy, equity_policy, utility_result = ... still works
+        return iter((
+            self.to_frame("consumption_policy"),
+            self.to_frame("equity_policy"),
+            self.to_frame("utility_result"),
+        ))
+
+    def row(self, age):
+        return int(age - self.ages[0])
+
+    def utility_function(self, age):
+        return PchipInterpolator(self.wealth_grid, self.utility_result[self.row(age)])
+
+    def save(self, path):
+        np.savez(
+            path,
+            ages=self.ages,
+            wealth_grid=self.wealth_grid,
+            consumption_policy=self.consumption_policy,
+            equity_policy=self.equity_policy,
+            utility_result=self.utility_result,
+            iterations=self.iterations,
+            evaluations=self.evaluations,
+            levels=self.levels,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            solution = cls(data["ages"], data["wealth_grid"])
+            solution.consumption_policy = data["consumption_policy"]
+            solution.equity_policy = data["equity_policy"]
+            solution.utility_result = data["utility_result"]
+            solution.iterations = data["iterations"]
+            solution.evaluations = data["evaluations"]
+            # files saved before the adaptive solver have no levels
+            if "levels" in data:
+                solution.levels = data["levels"]
+        return solution
+
+    def to_frame(self, name="consumption_policy"):
+        # pandas is only needed by whoever wants the frames
+        import pandas as pd
+
+        return pd.DataFrame(getattr(self, name), index=self.ages, columns=self.wealth_grid)
+
+
+def _solve_age_slsqp(wealth_vector, current_age, future_utility_function, context, jac=True,
+                     initial_guess=None, ftol=None):
+    # with jac=True SLSQP gets the analytic gradient, built from the derivative of the
+    # next-age interpolator; plain callables without .derivative use finite differences.
+    # initial_guess holds a (consumption, equity) starting point per wealth point, otherwise
+    # I start from [wealth / 2, 0.99]. Every point is seeded on its own, never from the
+    # point solved before it, so splitting the grid between workers can't change the result.
+    # ftol is relative to wealth, None keeps SLSQP's absolute 1e-6
+    future_utility_derivative = None
+    if jac and hasattr(future_utility_function, "derivative"):
+        future_utility_derivative = future_utility_function.derivative()
+    consumption = np.zeros(len(wealth_vector))
+    equity = np.zeros(len(wealth_vector))
+    utility = np.zeros(len(wealth_vector))
+    iterations = np.zeros(len(wealth_vector), dtype=int)
+    evaluations = np.zeros(len(wealth_vector), dtype=int)
+    for i, wealth in enumerate(wealth_vector):
+        if initial_guess is not None:
+            guess = initial_guess[i]
+        else:
+            guess = [wealth / 2, 0.99]
+        guess = [np.clip(guess[0], 0, wealth), np.clip(guess[1], context.min_equity, 1)]
+        if future_utility_derivative is None:
+            fun = lambda x: -epstein_zin_utility(
+                x, wealth, current_age, future_utility_function, context
+            )
+        else:
+            def fun(x):
+                value, gradient = epstein_zin_utility_and_gradient(
+                    x, wealth, current_age, future_utility_function, context,
+                    future_utility_derivative,
+                )
+                return -value, -gradient
+        res = minimize(
+            fun,
+            guess,
+            method="SLSQP",
+            jac=future_utility_derivative is not None,
+            options={} if ftol is None else {"ftol": ftol * wealth},
+            bounds=[(0, wealth), (context.min_equity, 1)],
+        )
+        consumption[i] = res.x[0]
+        equity[i] = res.x[1]
+        utility[i] = np.abs(res.fun)
+        iterations[i] = res.nit
+        evaluations[i] = res.nfev
+    return consumption, equity, utility, iterations, evaluations
+
+
+def _continuation_term(savings, equity, current_age, future_utility_function, context,
+                       future_utility_derivative=None):
+    # the (delta * E[p * V ** (1 - gamma)]) ** theta term of the Epstein-Zin aggregator as a
+    # function of what is saved, and optionally its derivative with respect to savings
+    rho = 1 - 1 / context.psi
+    theta = rho / (1 - context.gamma)
+    growth = context.portfolio_growth(equity)
+    new_wealth = context.income[current_age] + savings[..., np.newaxis] * growth
+    future_utility = np.maximum(future_utility_function(new_wealth), 0)
+    weights = context.risky_probability * context.survival_probability[current_age]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected_future_utility = np.maximum(
+            _expectation(future_utility ** (1 - context.gamma), weights), 1e-20
+        )
+        term = (context.delta * expected_future_utility) ** theta
+        if future_utility_derivative is None:
+            return term
+        marginal = np.where(
+            future_utility > 0,
+            (1 - context.gamma)
+            * future_utility ** -context.gamma
+            * future_utility_derivative(new_wealth)
+            * growth,
+            0,
+        )
+        term_derivative = (
+            theta * context.delta * (context.delta * expected_future_utility) ** (theta - 1)
+            * _expectation(marginal, weights)
+        )
+    return term, term_derivative
+
+
+def _best_equity(savings, current_age, future_utility_function, context, equity_points,
+                 refine_steps):
+    # the equity share only enters through the continuation term, so for a given amount
+    # saved I tabulate it on a lattice and refine with a 1-d zoom, for all savings at once.
+    # When 1 - 1/psi < 0 the value falls as the term grows, so I minimise it
+    sign = 1 if 1 - 1 / context.psi > 0 else -1
+    equity_levels = np.linspace(context.min_equity, 1, equity_points)
+    terms = sign * _continuation_term(
+        savings[:, np.newaxis], equity_levels[np.newaxis, :], current_age,
+        future_utility_function, context,
+    )
+    best = np.nanargmax(np.nan_to_num(terms, nan=-np.inf), axis=1)
+    equity = equity_levels[best]
+    score = terms[np.arange(len(savings)), best]
+    step = (1 - context.min_equity) / (equity_points - 1)
+    offsets = np.array([-1.0, 0.0, 1.0])
+    rows = np.arange(len(savings))
+    for _ in range(refine_steps):
+        candidates = np.clip(equity[:, np.newaxis] + offsets * step, context.min_equity, 1)
+        terms = np.nan_to_num(
+            sign * _continuation_term(
+                savings[:, np.newaxis], candidates, current_age, future_utility_function, context
+            ),
+            nan=-np.inf,
+        )
+        terms[:, 1] = np.maximum(terms[:, 1], score)
+        best = terms.argmax(axis=1)
+        best = np.where(terms[rows, best] > terms[:, 1], best, 1)
+        equity = candidates[rows, best]
+        score = terms[rows, best]
+        step /= 2
+    return equity
+
+
+def _solve_age_egm(wealth_vector, current_age, future_utility_function, context, equity_points,
+                   refine_steps, savings_grid=None):
+    # endogenous grid method: on a grid of savings the Euler equation
+    # (1 - delta) * rho * c ** (rho - 1) = d term / d savings gives consumption in closed
+    # form, and savings + consumption is the wealth at which that choice is optimal.
+    # Consumption is then interpolated back on wealth_vector; below the first endogenous
+    # point the investor consumes everything. The savings grid is the full wealth grid
+    # even when wealth_vector is one worker's chunk of it
+    if savings_grid is None:
+        savings_grid = context.wealth_grid
+    rho = 1 - 1 / context.psi
+    future_utility_derivative = future_utility_function.derivative()
+    savings = np.concatenate(([0.0], savings_grid))
+    equity = _best_equity(
+        savings, current_age, future_utility_function, context, equity_points, refine_steps
+    )
+    _, term_derivative = _continuation_term(
+        savings, equity, current_age, future_utility_function, context,
+        future_utility_derivative,
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        endogenous_consumption = (term_derivative / ((1 - context.delta) * rho)) ** (1 / (rho - 1))
+    valid = np.isfinite(endogenous_consumption) & (endogenous_consumption > 0)
+    endogenous_wealth = savings[valid] + endogenous_consumption[valid]
+    endogenous_consumption = endogenous_consumption[valid]
+    # np.interp needs increasing wealth; where the value function isn't concave the
+    # endogenous grid can fold back, and I keep the increasing part
+    keep = endogenous_wealth >= np.maximum.accumulate(endogenous_wealth)
+    endogenous_wealth = endogenous_wealth[keep]
+    endogenous_consumption = endogenous_consumption[keep]
+
+    # without income, saving nothing leaves no future utility and the constraint never
+    # binds; consumption then goes to 0 with wealth instead of consuming everything
+    borrowing_constrained = valid[0]
+    if not borrowing_constrained:
+        endogenous_wealth = np.concatenate(([0.0], endogenous_wealth))
+        endogenous_consumption = np.concatenate(([0.0], endogenous_consumption))
+
+    consumption = np.interp(wealth_vector, endogenous_wealth, endogenous_consumption)
+    # linear extrapolation above the last endogenous point
+    slope = (endogenous_consumption[-1] - endogenous_consumption[-2]) / (
+        endogenous_wealth[-1] - endogenous_wealth[-2]
+    )
+    above = wealth_vector > endogenous_wealth[-1]
+    consumption[above] = endogenous_consumption[-1] + slope * (
+        wealth_vector[above] - endogenous_wealth[-1]
+    )
+    consumption = np.clip(consumption, 0, wealth_vector)
+    if borrowing_constrained:
+        constrained = wealth_vector <= endogenous_wealth[0]
+        consumption[constrained] = wealth_vector[constrained]
+
+    # the equity share for the savings actually chosen, and the exact value of the choice
+    equity = _best_equity(
+        wealth_vector - consumption, current_age, future_utility_function, context,
+        equity_points, refine_steps,
+    )
+    utility = epstein_zin_utility_vectorized(
+        consumption, equity, wealth_vector, current_age, future_utility_function, context
+    )
+    iterations = np.full(len(wealth_vector), refine_steps)
+    evaluations = np.full(len(wealth_vector), 2 * (equity_points + 3 * refine_steps) + 2)
+    return consumption, equity, utility, iterations, evaluations
+
+
+def _solve_age(wealth_vector, current_age, future_utility_function, context, method, settings,
+               initial_guess=None):
+    if method == "egm":
+        return _solve_age_egm(
+            wealth_vector,
+            current_age,
+            future_utility_function,
+            context,
+            settings["equity_points"],
+            settings["refine_steps"],
+            settings.get("savings_grid"),
+        )
+    if method == "grid":
+        return _solve_age_grid(
+            wealth_vector,
+            current_age,
+            future_utility_function,
+            context,
+            settings["consumption_points"],
+            settings["equity_points"],
+            settings["refine_steps"],
+        )
+    return _solve_age_slsqp(
+        wealth_vector,
+        current_age,
+        future_utility_function,
+        context,
+        settings["jac"],
+        initial_guess,
+        settings["ftol"],
+    )
+
+
+# each worker process receives the context once, when the pool starts
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _solve_wealth_chunk(wealth_chunk, current_age, breakpoints, coefficients, method, settings,
+                        initial_guess):
+    # the Pchip interpolator is a piecewise polynomial, so I rebuild it from its
+    # breakpoints and coefficients instead of pickling the interpolator itself
+    future_utility_function = PPoly.construct_fast(coefficients, breakpoints)
+    return _solve_age(
+        wealth_chunk, current_age, future_utility_function, _worker_context, method, settings,
+        initial_guess,
+    )
+
+
+def _solve_age_parallel(executor, workers, wealth_vector, current_age, future_utility_function,
+                        method, settings, initial_guess=None):
+    # one contiguous chunk of the wealth grid per worker, so the interpolator is shipped
+    # to every worker once per age. Every wealth point is solved independently of the
+    # others, so the result doesn't depend on the number of workers
+    futures = [
+        executor.submit(
+            _solve_wealth_chunk,
+            wealth_vector[chunk],
+            current_age,
+            future_utility_function.x,
+            future_utility_function.c,
+            method,
+            settings,
+            None if initial_guess is None else initial_guess[chunk],
+        )
+        for chunk in np.array_split(np.arange(len(wealth_vector)), workers)
+        if len(chunk)
+    ]
+    results = [future.result() for future in futures]
+    return tuple(np.concatenate(part) for part in zip(*results))
+
+
+def _share_guess(grid, consumption_share, equity, wealth_vector):
+    # (consumption, equity) seeds at wealth_vector from a policy solved on grid: the shares
+    # are interpolated linearly between its wealth points
+    return np.column_stack((np.interp(wealth_vector, grid, consumption_share) * wealth_vector,
+                            np.interp(wealth_vector, grid, equity)))
+
+
+def _solve_points(context, wealth_vector, current_age, future_utility_function, method, settings,
+                  initial_guess=None, executor=None, workers=None):
+    if executor is None:
+        return _solve_age(wealth_vector, current_age, future_utility_function, context, method,
+                          settings, initial_guess)
+    return _solve_age_parallel(executor, workers, wealth_vector, current_age,
+                               future_utility_function, method, settings, initial_guess)
+
+
+def _terminal_utility(context, wealth_vector):
+    return ((1 - context.delta) * wealth_vector ** (1 - 1 / context.psi)) ** (
+        1 / (1 - 1 / context.psi)
+    )
+
+
+def _backward_induction(context, wealth_vector, method, settings, warm_start, executor=None,
+                        workers=None):
+    # one full solve on wealth_vector
+    solution = LifecycleSolution(context.age_levels + [context.end_age], wealth_vector)
 
     # Here I solve the problem for the investor at terminal age
     consumption = wealth_vector
-    vtplus1 = ((1 - investor.DELTA) * wealth_vector ** (1 - 1 / investor.PSI)) ** (
-        1 / (1 - 1 / investor.PSI)
-    )
+    vtplus1 = _terminal_utility(context, wealth_vector)
     utility = vtplus1
-    consumption_policy.loc[investor.END_AGE, :] = consumption / wealth_vector
-    equity_policy.loc[investor.END_AGE, :] = investor.MIN_EQUITY
-    utility_result.loc[investor.END_AGE, :] = utility
-    interpolated_utility_policy = PchipInterpolator(wealth_vector, vtplus1)
+    terminal = solution.row(context.end_age)
+    solution.consumption_policy[terminal] = consumption / wealth_vector
+    solution.equity_policy[terminal] = context.min_equity
+    solution.utility_result[terminal] = utility
 
     # I use this loop to reverse-solve the problem until starting age
-    for current_age in investor.AGE_LEVELS[::-1][:]:
-        interpolated_utility_policy = PchipInterpolator(
-            wealth_vector, utility_result.loc[current_age + 1, :]
-        )
+    for current_age in context.age_levels[::-1][:]:
+        interpolated_utility_policy = solution.utility_function(current_age + 1)
         # print(utility_result.loc[current_age, :])
         # x = wealth_vector
         # y = interpolated_utility_policy(wealth_vector)
         # plt.plot(x, y, 'r')
         # plt.show()
-        for wealth in wealth_vector:
-            fun = lambda x: -epstein_zin_utility(
-                x, wealth, current_age, interpolated_utility_policy
-            )
-            res = minimize(
-                fun,
-                [wealth / 2, 0.99],
-                method="SLSQP",
-                bounds=[(0, wealth), (investor.MIN_EQUITY, 1)],
-            )
-            consumption_policy.loc[current_age, wealth] = res.x[0] / wealth
-            equity_policy.loc[current_age, wealth] = res.x[1]
-            utility_result.loc[current_age, wealth] = np.abs(res.fun)
+        initial_guess = None
+        if warm_start and current_age + 1 != context.end_age:
+            previous = solution.row(current_age + 1)
+            initial_guess = np.column_stack((
+                solution.consumption_policy[previous] * wealth_vector,
+                solution.equity_policy[previous],
+            ))
+        consumption, equity, utility, iterations, evaluations = _solve_points(
+            context, wealth_vector, current_age, interpolated_utility_policy, method, settings,
+            initial_guess, executor, workers,
+        )
+        row = solution.row(current_age)
+        solution.consumption_policy[row] = consumption / wealth_vector
+        solution.equity_policy[row] = equity
+        solution.utility_result[row] = utility
+        solution.iterations[row] = iterations
+        solution.evaluations[row] = evaluations
         # risky_ret, risky_prob = quantecon.quad.qnwnorm(
         #    n=10,
         #    mu=investor.RISK_ASSET_AVERAGE_RETURN,
@@ -107,4 +626,225 @@ def optimize_lifecycle():
         #    risky_prob,
         #    interpolated_utility_policy(new_wealth),
         # ))
-    return (consumption_policy, equity_policy, utility_result)
+    return solution
+
+
+def _pchip_slope(h_left, h_right, m_left, m_right):
+    # Pchip derivative at an interior node from the widths and slopes of its two intervals,
+    # as in scipy's PchipInterpolator: the weighted harmonic mean, 0 at a local extremum
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w1 = 2 * h_right + h_left
+        w2 = h_right + 2 * h_left
+        slope = (w1 + w2) / (w1 / m_left + w2 / m_right)
+    flat = (np.sign(m_left) != np.sign(m_right)) | (m_left == 0) | (m_right == 0)
+    return np.where(flat, 0.0, slope)
+
+
+def _pchip_edge_slope(h0, h1, m0, m1):
+    # scipy's one-sided three-point derivative at the ends of a Pchip interpolant
+    slope = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+    overshoot = (np.sign(m0) != np.sign(m1)) & (np.abs(slope) > 3 * np.abs(m0))
+    slope = np.where(overshoot, 3 * m0, slope)
+    return np.where(np.sign(slope) != np.sign(m0), 0.0, slope)
+
+
+def _leave_one_out_errors(grid, values):
+    # |Pchip of the other points - value| at every interior point of grid, for every row of
+    # values, in one pass: without point i the interval is (i - 1, i + 1) and its end
+    # slopes come from i - 2 and i + 2, so no interpolant is built. 0 at the grid ends
+    n = len(grid)
+    point = np.arange(1, n - 1)
+    left, right = point - 1, point + 1
+    outer_left, outer_right = np.maximum(left - 1, 0), np.minimum(right + 1, n - 1)
+    width = grid[right] - grid[left]
+    slope = (values[:, right] - values[:, left]) / width
+    width_left = grid[left] - grid[outer_left]
+    width_right = grid[outer_right] - grid[right]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope_left = (values[:, left] - values[:, outer_left]) / width_left
+        slope_right = (values[:, outer_right] - values[:, right]) / width_right
+    # at the first and last point of the reduced grid the derivative is one-sided
+    derivative_left = np.where(
+        left > 0, _pchip_slope(width_left, width, slope_left, slope),
+        _pchip_edge_slope(width, width_right, slope, slope_right))
+    derivative_right = np.where(
+        right < n - 1, _pchip_slope(width, width_right, slope, slope_right),
+        _pchip_edge_slope(width, width_left, slope, slope_left))
+    # cubic Hermite basis at the dropped point
+    t = (grid[point] - grid[left]) / width
+    estimate = ((2 * t ** 3 - 3 * t ** 2 + 1) * values[:, left]
+                + (t ** 3 - 2 * t ** 2 + t) * width * derivative_left
+                + (-2 * t ** 3 + 3 * t ** 2) * values[:, right]
+                + (t ** 3 - t ** 2) * width * derivative_right)
+    errors = np.zeros(values.shape)
+    errors[:, 1:-1] = np.abs(estimate - values[:, point])
+    return errors
+
+
+def refinement_indicator(wealth_grid, utility, consumption_share):
+    # Leave-one-out interpolation error: every interior wealth point is dropped from the
+    # grid and the Pchip interpolant of the rest is compared with its solved value, the
+    # largest error over the rows (ages) of utility and consumption_share, which may also
+    # be a single age. Utility errors are relative, consumption errors in shares. The
+    # equity share is left out: SLSQP only resolves it to about 1e-2 (its error against a
+    # dense solve stays there however fine the grid), so any useful tolerance would
+    # refine everywhere. An interval gets the larger error of its two ends, the grid ends
+    # count as 0. The grid needs at least 4 points. Returns the geometric midpoints and
+    # their errors
+    grid = np.asarray(wealth_grid, dtype=float)
+    utility = np.atleast_2d(utility)
+    relative = _leave_one_out_errors(grid, utility) / np.maximum(np.abs(utility), 1e-20)
+    errors = np.maximum(relative, _leave_one_out_errors(grid, np.atleast_2d(consumption_share))).max(axis=0)
+    midpoints = np.sqrt(grid[:-1] * grid[1:])
+    return midpoints, np.maximum(errors[:-1], errors[1:])
+
+
+def _adaptive_induction(context, method, settings, warm_start, refine_tol, max_levels,
+                        executor=None, workers=None):
+    # Backward induction where every age refines its own wealth grid: the age is solved
+    # on WEALTH_GRID (seeded from the age above with warm_start), then, up to max_levels
+    # times, the midpoints of the intervals whose refinement_indicator is above refine_tol
+    # are solved, seeded from the policy of the same age, and nothing else is solved
+    # again. The next age down interpolates the utility on the grid of this age.
+    # The solution is written on the union of all the grids; an age is Pchip-interpolated
+    # at the points other ages added, which its own check found resolved to refine_tol,
+    # and those cells count 0 evaluations. Returns the solution, the (cells, evaluations)
+    # of every level and the ages still above refine_tol after the last level
+    base = context.wealth_grid
+    ages = context.age_levels + [context.end_age]
+    # age -> (grid, consumption share, equity, utility, iterations, evaluations)
+    rows = {context.end_age: (base, np.ones(len(base)), np.full(len(base), context.min_equity),
+                              _terminal_utility(context, base), np.zeros(len(base), dtype=int),
+                              np.zeros(len(base), dtype=int))}
+    levels = np.zeros((max_levels + 1, 2), dtype=int)
+    unresolved = []
+    for current_age in context.age_levels[::-1]:
+        above = rows[current_age + 1]
+        future_utility_function = PchipInterpolator(above[0], above[3])
+        grid = base
+        initial_guess = None
+        if warm_start and current_age + 1 != context.end_age:
+            initial_guess = _share_guess(above[0], above[1], above[2], grid)
+        consumption, equity, utility, iterations, evaluations = _solve_points(
+            context, grid, current_age, future_utility_function, method, settings,
+            initial_guess, executor, workers,
+        )
+        row = (grid, consumption / grid, equity, utility, iterations, evaluations)
+        levels[0] += (len(grid), evaluations.sum())
+        for level in range(1, max_levels + 2):
+            midpoints, gaps = refinement_indicator(row[0], row[3], row[1])
+            new_points = midpoints[gaps > refine_tol]
+            if not len(new_points):
+                break
+            if level > max_levels:
+                unresolved.append(current_age)
+                break
+            consumption, equity, utility, iterations, evaluations = _solve_points(
+                context, new_points, current_age, future_utility_function, method, settings,
+                _share_guess(row[0], row[1], row[2], new_points), executor, workers,
+            )
+            levels[level] += (len(new_points), evaluations.sum())
+            added = (new_points, consumption / new_points, equity, utility, iterations, evaluations)
+            order = np.argsort(np.concatenate((row[0], new_points)))
+            row = tuple(np.concatenate(pair)[order] for pair in zip(row, added))
+        rows[current_age] = row
+
+    union = np.unique(np.concatenate([row[0] for row in rows.values()]))
+    solution = LifecycleSolution(ages, union)
+    for age, (grid, consumption_share, equity, utility, iterations, evaluations) in rows.items():
+        index = solution.row(age)
+        solved = np.searchsorted(union, grid)
+        for name, values in (("consumption_policy", consumption_share), ("equity_policy", equity),
+                             ("utility_result", utility)):
+            getattr(solution, name)[index] = PchipInterpolator(grid, values)(union)
+            getattr(solution, name)[index, solved] = values
+        solution.iterations[index, solved] = iterations
+        solution.evaluations[index, solved] = evaluations
+    # the terminal age has a closed form on any grid
+    terminal = solution.row(context.end_age)
+    solution.utility_result[terminal] = _terminal_utility(context, union)
+    used = levels[:, 0] > 0
+    return solution, levels[used], unresolved
+
+
+def optimize_lifecycle(method="slsqp", consumption_points=26, equity_points=11, refine_steps=12,
+                       quadrature_nodes=10, context=None, jac=True, workers=None,
+                       parameters=investor, warm_start=False, ftol=None, adaptive=False,
+                       refine_tol=3e-4, max_levels=10):
+    # method="slsqp" runs one SLSQP optimization per (age, wealth) point.
+    # method="grid" solves all the wealth points of an age at once on a lattice of
+    # consumption and equity shares followed by refine_steps batched zoom steps.
+    # Given the same next-age utility, the grid utilities are never below the SLSQP ones
+    # by more than 1e-8 relative on the default WEALTH_GRID (they are often above, since
+    # SLSQP stops early at low wealth). Policies agree to about 1e-2 wherever the
+    # objective depends on them; the equity share is arbitrary when all wealth is consumed
+    # method="egm" inverts the Euler equation on a savings grid (see _solve_age_egm). Its
+    # utilities are within 2e-4 relative of SLSQP with ftol=1e-8; where at least 5% of
+    # wealth is saved its consumption shares agree to 0.02 and its equity shares to about
+    # 0.08 (6e-3 at the 99th percentile), since equity is picked on the savings grid and
+    # the objective is flat near the optimum
+    # The quadrature and the income and survival tables are built once per solve in a
+    # ModelContext from parameters (the investor module or an investor.InvestorParameters);
+    # quadrature_nodes trades accuracy for speed. jac=False makes SLSQP fall
+    # back to finite differences instead of the analytic gradient. workers > 1 spreads the
+    # wealth points of every age over a process pool. warm_start=True seeds every SLSQP
+    # cell from the same wealth point one age later; the first solved age starts cold in
+    # every mode, so serial and parallel solves agree bit for bit. solution.iterations and solution.evaluations count
+    # the work spent per cell. ftol sets the SLSQP tolerance relative to wealth; SLSQP's own
+    # is absolute, so at the bottom of the grid (utilities around 1e-3) it stops right at a
+    # warm seed. That is why warm_start defaults to ftol=1e-8, which keeps the warm and cold
+    # utilities within 1e-4 relative of each other and of a dense grid solve.
+    # adaptive=True refines the wealth grid of every age on its own (see
+    # _adaptive_induction): an age is solved on WEALTH_GRID, then only the midpoints where
+    # refinement_indicator is above refine_tol are solved, up to max_levels times, seeded
+    # from the same age (so it also defaults to ftol=1e-8). The default refine_tol sits
+    # just above the ~1e-4 consumption share SLSQP resolves at that ftol; a smaller one
+    # chases solver noise. The points where consumption leaves the all-consumed corner
+    # converge slowly, and a warning says how many ages are still above refine_tol when
+    # the levels run out. Only slsqp can be refined: the grid and egm policies are too
+    # noisy for the indicator. On the default model it takes about half the
+    # evaluations of a uniform grid of the same accuracy. solution.levels holds the cells
+    # solved and their evaluations at every level, summed over the ages
+    # Returns a LifecycleSolution, which also unpacks into the three policy frames
+    if method not in ("slsqp", "grid", "egm"):
+        raise ValueError("Unknown method: %s" % method)
+    if adaptive and method != "slsqp":
+        raise ValueError("Only slsqp solves can be refined adaptively, not %s" % method)
+    if context is None:
+        context = ModelContext(parameters, quadrature_nodes)
+    wealth_vector = context.wealth_grid
+    settings = {
+        "consumption_points": consumption_points,
+        "equity_points": equity_points,
+        "refine_steps": refine_steps,
+        "jac": jac,
+        "ftol": 1e-8 if ftol is None and (warm_start or adaptive) else ftol,
+        "savings_grid": wealth_vector,
+    }
+    executor = None
+    if workers is not None and workers > 1:
+        # spawn rather than fork: forking after quantecon (numba) is imported can leave
+        # the interpreter hanging at exit
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(context,),
+        )
+
+    # the pool is shut down even when a solve raises, so no spawned worker is left behind
+    try:
+        if adaptive:
+            solution, solution.levels, unresolved = _adaptive_induction(
+                context, method, settings, warm_start, refine_tol, max_levels, executor, workers)
+            if unresolved:
+                warnings.warn("%d ages are still above refine_tol=%g after %d levels, raise max_levels "
+                              "to refine them further" % (len(unresolved), refine_tol, max_levels),
+                              stacklevel=2)
+        else:
+            solution = _backward_induction(context, wealth_vector, method, settings, warm_start,
+                                           executor, workers)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return solution
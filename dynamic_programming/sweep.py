@@ -0,0 +1,90 @@
+# load libraries
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import investor
+import lifecycle
+
+
+def _canonical(value):
+    # json-ready copy of value in which equal configurations are written the same way:
+    # numpy scalars and arrays become python numbers and lists, and whole floats ints,
+    # so 4, 4.0 and np.int64(4) give the same key
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def parameter_hash(parameters, **options):
+    # the key covers the parameters and the solver options, so changing either one
+    # gives a new cache entry
+    payload = json.dumps(
+        _canonical({"parameters": parameters._asdict(), "options": options}), sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    # one .npz file per solved configuration, named after its parameter hash
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, key):
+        return lifecycle.LifecycleSolution.load(self.path(key))
+
+    def save(self, key, solution):
+        # write to a temporary file first so a crashed sweep never leaves half a result
+        temporary = self.path(key) + ".tmp.npz"
+        solution.save(temporary)
+        os.replace(temporary, self.path(key))
+
+
+def _solve(parameters, options):
+    return lifecycle.optimize_lifecycle(parameters=parameters, **options)
+
+
+def sweep(parameter_sets, cache_directory="sweep_cache", workers=None, **options):
+    # parameter_sets is a list of investor.InvestorParameters (or of dicts of overrides for
+    # investor.make_parameters). Configurations already in the cache are loaded, the
+    # others are solved concurrently and stored. options go to optimize_lifecycle.
+    # Returns the solutions in the same order as parameter_sets
+    parameter_sets = [
+        investor.make_parameters(**parameters) if isinstance(parameters, dict) else parameters
+        for parameters in parameter_sets
+    ]
+    cache = ResultCache(cache_directory)
+    keys = [parameter_hash(parameters, **options) for parameters in parameter_sets]
+    # identical configurations in the same sweep are solved once
+    missing = {}
+    for key, parameters in zip(keys, parameter_sets):
+        if key not in cache and key not in missing:
+            missing[key] = parameters
+
+    if missing:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = {
+                key: executor.submit(_solve, parameters, options)
+                for key, parameters in missing.items()
+            }
+            for key, future in futures.items():
+                cache.save(key, future.result())
+
+    return [cache.load(key) for key in keys]
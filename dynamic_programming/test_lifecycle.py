@@ -0,0 +1,105 @@
+# load libraries
+import numpy as np
+import pytest
+from scipy.interpolate import PchipInterpolator
+import investor
+import lifecycle
+
+
+@pytest.fixture(scope="module")
+def egm_and_slsqp():
+    # both engines on the default WEALTH_GRID; SLSQP with the tight tolerance is the
+    # reference the egm engine was checked against
+    return (lifecycle.optimize_lifecycle(method="egm"),
+            lifecycle.optimize_lifecycle(method="slsqp", ftol=1e-8))
+
+
+def test_egm_utility_matches_slsqp(egm_and_slsqp):
+    egm, slsqp = egm_and_slsqp
+    relative = np.abs(egm.utility_result / slsqp.utility_result - 1)
+    assert relative.max() < 2e-4
+    assert np.median(relative) < 1e-6
+
+
+def test_egm_consumption_matches_slsqp_where_equity_matters(egm_and_slsqp):
+    # the equity share only matters when something is saved; where SLSQP saves at least
+    # 5% of wealth the consumption shares agree to 0.02 (about 0.01 on the default grid)
+    egm, slsqp = egm_and_slsqp
+    saving = slsqp.consumption_policy < 0.95
+    # most cells save, so the check covers most of the grid
+    assert saving.sum() > 0.8 * saving.size
+    difference = np.abs(egm.consumption_policy - slsqp.consumption_policy)[saving]
+    assert difference.max() < 0.02
+    assert np.percentile(difference, 99) < 1e-3
+
+
+def test_egm_equity_matches_slsqp_where_equity_matters(egm_and_slsqp):
+    # the egm equity share is picked on the savings grid, so where SLSQP saves at least 5%
+    # of wealth it differs by up to 0.1 (0.081 on the default grid, in a few cells near the
+    # top of the range where the objective is flat) and by 1e-2 at the 99th percentile
+    egm, slsqp = egm_and_slsqp
+    saving = slsqp.consumption_policy < 0.95
+    difference = np.abs(egm.equity_policy - slsqp.equity_policy)[saving]
+    assert difference.max() < 0.1
+    assert np.percentile(difference, 99) < 1e-2
+    assert np.median(difference) < 1e-6
+
+
+def _p99_errors(solution, reference):
+    # 99th percentiles of the consumption share error and the relative utility error, with
+    # solution interpolated on the reference grid
+    errors = []
+    for name in ("consumption_policy", "utility_result"):
+        values = PchipInterpolator(solution.wealth_grid, getattr(solution, name), axis=1)(
+            reference.wealth_grid)
+        error = np.abs(values - getattr(reference, name))
+        if name == "utility_result":
+            error = error / np.abs(getattr(reference, name))
+        errors.append(np.percentile(error, 99))
+    return errors
+
+
+def test_adaptive_beats_a_uniform_grid():
+    # ages 60 to 99 keep the retirement kink at a third of the cost. From the 30 points of
+    # WEALTH_GRID the adaptive solve needs about half the evaluations of a uniform 73-point
+    # grid for the same accuracy against a 193-point one
+    def grid(points):
+        return np.exp(np.linspace(-6, 3, points))
+
+    reference = lifecycle.optimize_lifecycle(
+        parameters=investor.make_parameters(START_AGE=60, WEALTH_GRID=grid(193)), warm_start=True)
+    uniform = lifecycle.optimize_lifecycle(
+        parameters=investor.make_parameters(START_AGE=60, WEALTH_GRID=grid(73)), warm_start=True)
+    adaptive = lifecycle.optimize_lifecycle(
+        parameters=investor.make_parameters(START_AGE=60), warm_start=True, adaptive=True)
+    assert adaptive.evaluations.sum() < 0.6 * uniform.evaluations.sum()
+    assert adaptive.levels[:, 1].sum() == adaptive.evaluations.sum()
+    consumption_error, utility_error = _p99_errors(adaptive, reference)
+    uniform_consumption_error, uniform_utility_error = _p99_errors(uniform, reference)
+    assert consumption_error < uniform_consumption_error
+    assert utility_error < uniform_utility_error
+
+
+def test_leave_one_out_errors_match_pchip():
+    rng = np.random.default_rng(0)
+    grid = np.sort(rng.random(12)) + 0.1
+    values = np.cumsum(rng.random((3, 12)), axis=1)
+    expected = np.zeros_like(values)
+    for point in range(1, len(grid) - 1):
+        others = np.delete(np.arange(len(grid)), point)
+        expected[:, point] = np.abs(
+            PchipInterpolator(grid[others], values[:, others], axis=1)(grid[point]) - values[:, point])
+    np.testing.assert_allclose(lifecycle._leave_one_out_errors(grid, values), expected, atol=1e-12)
+
+
+def test_adaptive_needs_slsqp():
+    with pytest.raises(ValueError):
+        lifecycle.optimize_lifecycle(method="egm", adaptive=True)
+
+
+def test_warm_start_does_not_depend_on_workers():
+    # every cell is seeded on its own, so splitting the grid between processes changes nothing
+    serial = lifecycle.optimize_lifecycle(warm_start=True)
+    parallel = lifecycle.optimize_lifecycle(warm_start=True, workers=2)
+    for name in ("consumption_policy", "equity_policy", "utility_result", "evaluations"):
+        np.testing.assert_array_equal(getattr(serial, name), getattr(parallel, name))
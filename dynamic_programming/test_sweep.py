@@ -0,0 +1,14 @@
+# load libraries
+import numpy as np
+import investor
+import sweep
+
+
+def test_equal_configurations_share_a_key():
+    parameters = [investor.make_parameters(GAMMA=4), investor.make_parameters(GAMMA=4.0),
+                  investor.make_parameters(GAMMA=np.int64(4), START_AGE=np.int64(20))]
+    assert parameters[0] == parameters[1] == parameters[2]
+    keys = {sweep.parameter_hash(value, refine_steps=step)
+            for value, step in zip(parameters, (12, 12.0, np.int64(12)))}
+    assert len(keys) == 1
+    assert sweep.parameter_hash(parameters[0], ftol=1e-8) != sweep.parameter_hash(parameters[0])
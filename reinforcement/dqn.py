@@ -1,18 +1,21 @@
 from lib_for_dqn import wrappers
 from lib_for_dqn import dqn_model
-from lib_for_dqn import lifecycle
+from lib_for_dqn import lifecycle_discrete
+from lib_for_dqn import replay
+from lib_for_dqn import instrumentation
+from lib_for_dqn import checkpoint
 
 import argparse
+import copy
+import queue
 import time
 import numpy as np
-import collections
 
 import torch
+import torch.multiprocessing as mp
 import torch.nn as nn
 import torch.optim as optim
 
-from tensorboardX import SummaryWriter
-
 
 DEFAULT_ENV_NAME = "LifeCycle"
 MEAN_REWARD_BOUND = 19.5
@@ -28,55 +31,94 @@ EPSILON_DECAY_LAST_FRAME = 10**5
 EPSILON_START = 1.0
 EPSILON_FINAL = 0.02
 
+PRIO_REPLAY_ALPHA = 0.6
+BETA_START = 0.4
+BETA_FRAMES = 10**5
+
+# the discrete lifecycle env takes a dict action, the network has one head per key
+ACTION_KEYS = ("equity_allocation", "consumption")
+
+# with --actors, each actor sends its transitions in chunks of this many steps and the
+# learner publishes its weights every --sync-interval optimizer steps
+ACTOR_CHUNK_STEPS = 64
+ACTOR_QUEUE_SIZE = 64
+ACTOR_SYNC_INTERVAL = 100
+
+# phase timings go to tensorboard every this many frames
+TIMING_EXPORT_FRAMES = 10000
+
+# the full training state is saved every this many frames, keeping the newest few
+CHECKPOINT_FRAMES = 50000
+CHECKPOINT_KEEP = 3
+
+
+def make_env():
+    return wrappers.DictToVector(lifecycle_discrete.LifecycleEnv())
 
-Experience = collections.namedtuple('Experience', field_names=['state', 'action', 'reward', 'done', 'new_state'])
 
+class ActorInput:
+    # The observations the actor feeds to the network, written into the same tensor every
+    # step: a host tensor numpy writes into and, when acting on a GPU, a device copy the
+    # pinned host tensor is transferred to without blocking
+    def __init__(self):
+        self.host_v = None
 
-class ExperienceBuffer:
-    def __init__(self, capacity):
-        self.buffer = collections.deque(maxlen=capacity)
+    def __call__(self, states, device):
+        device = torch.device(device)
+        if self.host_v is None or self.host_v.shape != states.shape or self.device_v.device != device:
+            pinned = device.type == "cuda"
+            self.host_v = torch.empty(states.shape, dtype=torch.float32, pin_memory=pinned)
+            self.host_a = self.host_v.numpy()
+            self.device_v = self.host_v.to(device) if pinned else self.host_v
+        self.host_a[...] = states
+        if self.device_v is not self.host_v:
+            self.device_v.copy_(self.host_v, non_blocking=True)
+        return self.device_v
 
-    def __len__(self):
-        return len(self.buffer)
 
-    def append(self, experience):
-        self.buffer.append(experience)
+def greedy_actions(net, states_v):
+    # the best (equity, consumption) index pair for each row of states_v
+    with torch.inference_mode():
+        q_vals_v = net(states_v)
+        return torch.stack([torch.argmax(q_branch, dim=1) for q_branch in q_vals_v], dim=1).cpu().numpy()
 
-    def sample(self, batch_size):
-        indices = np.random.choice(len(self.buffer), batch_size, replace=False)
-        states, actions, rewards, dones, next_states = zip(*[self.buffer[idx] for idx in indices])
-        return np.array(states), np.array(actions), np.array(rewards, dtype=np.float32), \
-               np.array(dones, dtype=np.uint8), np.array(next_states)
+
+def random_action(env):
+    sampled_action = env.action_space.sample()
+    return np.array([sampled_action[key] for key in ACTION_KEYS], dtype=np.int64)
 
 
 class Agent:
-    def __init__(self, env, exp_buffer):
+    def __init__(self, env, exp_buffer, timer=None):
         self.env = env
         self.exp_buffer = exp_buffer
+        self.actor_input = ActorInput()
+        self.timer = timer if timer is not None else instrumentation.PhaseTimer(enabled=False)
         self._reset()
 
     def _reset(self):
-        self.state = env.reset()
+        self.state = self.env.reset()
         self.total_reward = 0.0
 
     def play_step(self, net, epsilon=0.0, device="cpu"):
         done_reward = None
 
-        if np.random.random() < epsilon:
-            action = env.action_space.sample()
-        else:
-            state_a = np.array([self.state], copy=False)
-            state_v = torch.tensor(state_a).to(device)
-            q_vals_v = net(state_v)
-            _, act_v = torch.max(q_vals_v, dim=1)
-            action = int(act_v.item())
+        # actions are kept as an (equity, consumption) index pair
+        with self.timer.phase("action_selection"):
+            if np.random.random() < epsilon:
+                action = random_action(self.env)
+            else:
+                state_v = self.actor_input(self.state[np.newaxis], device)
+                action = greedy_actions(net, state_v)[0]
 
         # do step in the environment
-        new_state, reward, is_done, _ = self.env.step(action)
+        with self.timer.phase("env_step"):
+            new_state, reward, is_done, _ = self.env.step(dict(zip(ACTION_KEYS, action)))
         self.total_reward += reward
 
-        exp = Experience(self.state, action, reward, is_done, new_state)
-        self.exp_buffer.append(exp)
+        with self.timer.phase("buffer_append"):
+            exp = replay.Experience(self.state, action, reward, is_done, new_state)
+            self.exp_buffer.append(exp)
         self.state = new_state
         if is_done:
             done_reward = self.total_reward
@@ -84,67 +126,289 @@ class Agent:
         return done_reward
 
 
-def calc_loss(batch, net, tgt_net, device="cpu"):
+class BatchAgent:
+    # Agent over a list of envs: one forward pass picks the actions of all of them and
+    # their transitions go to the buffer in one append_batch
+    def __init__(self, envs, exp_buffer, timer=None):
+        self.envs = envs
+        self.exp_buffer = exp_buffer
+        self.actor_input = ActorInput()
+        self.timer = timer if timer is not None else instrumentation.PhaseTimer(enabled=False)
+        self.states = np.array([env.reset() for env in envs], dtype=np.float32)
+        self.total_rewards = np.zeros(len(envs))
+
+    def play_step(self, net, epsilon=0.0, device="cpu"):
+        # returns the total rewards of the episodes that finished in this step
+        with self.timer.phase("action_selection"):
+            actions = greedy_actions(net, self.actor_input(self.states, device))
+            for index in np.flatnonzero(np.random.random(len(self.envs)) < epsilon):
+                actions[index] = random_action(self.envs[index])
+
+        new_states = np.empty_like(self.states)
+        rewards = np.empty(len(self.envs), dtype=np.float32)
+        dones = np.empty(len(self.envs), dtype=bool)
+        with self.timer.phase("env_step"):
+            for index, env in enumerate(self.envs):
+                new_states[index], rewards[index], dones[index], _ = env.step(dict(zip(ACTION_KEYS, actions[index])))
+        self.total_rewards += rewards
+        with self.timer.phase("buffer_append"):
+            self.exp_buffer.append_batch(self.states, actions, rewards, dones, new_states)
+
+        done_rewards = list(self.total_rewards[dones])
+        for index in np.flatnonzero(dones):
+            new_states[index] = self.envs[index].reset()
+            self.total_rewards[index] = 0.0
+        self.states = new_states
+        return done_rewards
+
+
+def make_agent(envs, exp_buffer, timer=None):
+    if len(envs) > 1:
+        return BatchAgent(envs, exp_buffer, timer)
+    return Agent(envs[0], exp_buffer, timer)
+
+
+def play_steps(agent, net, epsilon=0.0, device="cpu"):
+    # the total rewards of the episodes finished in this step, for both kinds of agent
+    done_rewards = agent.play_step(net, epsilon, device=device)
+    if isinstance(agent, BatchAgent):
+        return done_rewards
+    return [] if done_rewards is None else [done_rewards]
+
+
+def play_actor(actor_id, shared_net, weights_version, epsilon_value, exp_queue, n_envs):
+    # Actor process: plays its own envs with a local copy of the policy, reloads the
+    # shared weights whenever the learner has published new ones, and sends its
+    # transitions to the learner ACTOR_CHUNK_STEPS steps at a time. The tensors put on a
+    # torch.multiprocessing queue travel through shared memory instead of being pickled
+    torch.set_num_threads(1)
+    np.random.seed(actor_id)
+    net = copy.deepcopy(shared_net)
+    local_version = -1
+    # a ring that holds exactly one chunk, so after each chunk it is full and in order
+    chunk = replay.ExperienceBuffer(ACTOR_CHUNK_STEPS * n_envs)
+    agent = make_agent([make_env() for _ in range(n_envs)], chunk)
+    done_rewards = []
+    step = 0
+    while True:
+        if weights_version.value != local_version:
+            with weights_version.get_lock():
+                net.load_state_dict(shared_net.state_dict())
+                local_version = weights_version.value
+        done_rewards.extend(play_steps(agent, net, epsilon_value.value))
+        step += 1
+        if step % ACTOR_CHUNK_STEPS == 0:
+            arrays = (chunk.states, chunk.actions, chunk.rewards, chunk.dones, chunk.next_states)
+            exp_queue.put((tuple(torch.from_numpy(array.copy()) for array in arrays), done_rewards))
+            done_rewards = []
+
+
+def receive_experience(exp_queue, exp_buffer, block):
+    # move what the actors have sent into the buffer, waiting for the first chunk only
+    # when block is set. At most a queue's worth is taken per call, otherwise fast actors
+    # could keep the learner here forever. Returns the number of transitions and the total
+    # rewards of the finished episodes
+    frames = 0
+    done_rewards = []
+    for _ in range(ACTOR_QUEUE_SIZE):
+        try:
+            transitions, chunk_rewards = exp_queue.get(block=block, timeout=10)
+        except queue.Empty:
+            return frames, done_rewards
+        exp_buffer.append_batch(*(tensor.numpy() for tensor in transitions))
+        frames += len(transitions[0])
+        done_rewards.extend(chunk_rewards)
+        block = False
+    return frames, done_rewards
+
+
+# created once instead of on every call to calc_loss
+MSE_LOSS = nn.MSELoss()
+
+
+def calc_loss(batch, net, tgt_net, device="cpu", weights=None):
+    # the batch can be numpy arrays or tensors already on device, e.g. from
+    # buffer.sample(..., device=device), in which case nothing is copied
     states, actions, rewards, dones, next_states = batch
 
     # added fix here following this: https://stackoverflow.com/questions/68598000/i-get-this-error-using-pytorch-runtimeerror-gather-out-cpu-expected-dtype-i
-    actions = torch.from_numpy(actions)
-    actions = actions.type(torch.int64) 
-
-    states_v = torch.tensor(states).to(device)
-    next_states_v = torch.tensor(next_states).to(device)
-    actions_v = torch.tensor(actions).to(device)
-    rewards_v = torch.tensor(rewards).to(device)
-    done_mask = torch.ByteTensor(dones).to(device)
-
-    state_action_values = net(states_v).gather(1, actions_v.unsqueeze(-1)).squeeze(-1)
-    next_state_values = tgt_net(next_states_v).max(1)[0]
-    next_state_values[done_mask] = 0.0
-    next_state_values = next_state_values.detach()
+    actions_v = torch.as_tensor(actions, device=device).long()
+    states_v = torch.as_tensor(states, device=device)
+    next_states_v = torch.as_tensor(next_states, device=device)
+    rewards_v = torch.as_tensor(rewards, device=device)
+    done_mask = torch.as_tensor(dones, device=device).bool()
+
+    # one column per action branch; the target is shared by the branches and uses the
+    # mean of their greedy next-state values, as in branching dueling Q-networks
+    state_action_values = torch.stack(
+        [q_branch.gather(1, actions_v[:, branch].unsqueeze(-1)).squeeze(-1)
+         for branch, q_branch in enumerate(net(states_v))], dim=1)
+    with torch.no_grad():
+        next_state_values = torch.stack(
+            [q_branch.max(1)[0] for q_branch in tgt_net(next_states_v)], dim=1).mean(dim=1)
+        next_state_values[done_mask] = 0.0
 
     expected_state_action_values = next_state_values * BELLMAN_LEARNING_RATE + rewards_v
-    return nn.MSELoss()(state_action_values, expected_state_action_values)
+    expected_state_action_values = expected_state_action_values.unsqueeze(-1).expand_as(state_action_values)
+    if weights is None:
+        return MSE_LOSS(state_action_values, expected_state_action_values)
+    # with prioritized replay each squared error is scaled by its importance-sampling
+    # weight, and the TD errors go back to the buffer as the new priorities
+    td_errors = state_action_values - expected_state_action_values
+    weights_v = torch.as_tensor(weights, device=device)
+    return (weights_v.unsqueeze(-1) * td_errors ** 2).mean(), td_errors.detach().abs().mean(dim=1)
 
 
 if __name__ == "__main__":
+    # only training writes to tensorboard, so importing dqn for its helpers doesn't need it
+    from tensorboardX import SummaryWriter
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--cuda", default=False, action="store_true", help="Enable cuda")
     parser.add_argument("--env", default=DEFAULT_ENV_NAME,
                         help="Name of the environment, default=" + DEFAULT_ENV_NAME)
     parser.add_argument("--reward", type=float, default=MEAN_REWARD_BOUND,
                         help="Mean reward boundary for stop of training, default=%.2f" % MEAN_REWARD_BOUND)
+    parser.add_argument("--prioritized", default=False, action="store_true",
+                        help="Sample the replay buffer by TD error")
+    parser.add_argument("--replay-dir", default=None,
+                        help="Keep the replay buffer in memory-mapped files in this directory and "
+                             "resume from it if it already exists")
+    parser.add_argument("--envs", type=int, default=1,
+                        help="Number of envs stepped together with one forward pass, default=1")
+    parser.add_argument("--actors", type=int, default=0,
+                        help="Number of actor processes collecting experience while this process "
+                             "only learns, default=0 (act and learn in turn)")
+    parser.add_argument("--sync-interval", type=int, default=ACTOR_SYNC_INTERVAL,
+                        help="Optimizer steps between weight updates sent to the actors, default=%d"
+                             % ACTOR_SYNC_INTERVAL)
+    parser.add_argument("--profile-start", type=int, default=None,
+                        help="Frame at which to start profiling, default is no profiling")
+    parser.add_argument("--profile-frames", type=int, default=1000,
+                        help="Number of frames to profile, default=1000")
+    parser.add_argument("--profiler", default="torch", choices=["torch", "cprofile"],
+                        help="Profiler used for the capture window, default=torch")
+    parser.add_argument("--checkpoint-dir", default=None,
+                        help="Directory of the training checkpoints, default=<env>-checkpoints")
+    parser.add_argument("--checkpoint-frames", type=int, default=CHECKPOINT_FRAMES,
+                        help="Frames between checkpoints, default=%d" % CHECKPOINT_FRAMES)
+    parser.add_argument("--keep-checkpoints", type=int, default=CHECKPOINT_KEEP,
+                        help="Number of checkpoints kept, default=%d" % CHECKPOINT_KEEP)
+    parser.add_argument("--resume", default=False, action="store_true",
+                        help="Continue from the newest checkpoint in the checkpoint directory")
+    parser.add_argument("--checkpoint-buffer", default=False, action="store_true",
+                        help="Copy the in-memory replay buffer into every checkpoint, by default it "
+                             "is refilled after a resume (--replay-dir keeps it on disk instead)")
     args = parser.parse_args()
+    if args.prioritized and args.replay_dir is not None:
+        parser.error("--prioritized can't be combined with --replay-dir")
     device = torch.device("cuda" if args.cuda else "cpu")
 
     # Here I load a custom env
-    env = lifecycle.LifecycleEnv()
+    envs = [make_env() for _ in range(args.envs)]
+    env = envs[0]
 
-    net = dqn_model.DQN(env.observation_space.shape, env.action_space["equity_allocation"].n, env.action_space["consumption"].n).to(device)
-    tgt_net = dqn_model.DQN(env.observation_space.shape, env.action_space["equity_allocation"].n, env.action_space["consumption"].n).to(device)
+    branch_sizes = [env.action_space[key].n for key in ACTION_KEYS]
+    net = dqn_model.BranchingDQN(env.observation_space.low, env.observation_space.high, branch_sizes).to(device)
+    tgt_net = dqn_model.BranchingDQN(env.observation_space.low, env.observation_space.high, branch_sizes).to(device)
     writer = SummaryWriter(comment="-" + args.env)
     print(net)
 
-    buffer = ExperienceBuffer(REPLAY_SIZE)
-    agent = Agent(env, buffer)
+    if args.prioritized:
+        buffer = replay.PrioritizedExperienceBuffer(REPLAY_SIZE, alpha=PRIO_REPLAY_ALPHA)
+    elif args.replay_dir is not None:
+        buffer = replay.DiskExperienceBuffer(args.replay_dir, REPLAY_SIZE)
+    else:
+        buffer = replay.ExperienceBuffer(REPLAY_SIZE)
     epsilon = EPSILON_START
-
     optimizer = optim.Adam(net.parameters(), lr=LEARNING_RATE)
     total_rewards = []
     frame_idx = 0
-    ts_frame = 0
-    ts = time.time()
     best_mean_reward = None
+    last_sync_frame = 0
+    optimizer_steps = 0
+    checkpoints = checkpoint.CheckpointManager(
+        args.checkpoint_dir or args.env + "-checkpoints", keep=args.keep_checkpoints)
+    if args.resume:
+        state = checkpoints.load(map_location=device)
+        if state is None:
+            print("No checkpoint to resume from, starting a new run")
+        else:
+            net.load_state_dict(state["net"])
+            tgt_net.load_state_dict(state["tgt_net"])
+            optimizer.load_state_dict(state["optimizer"])
+            buffer_state = state.get("buffer")
+            if buffer_state is not None and "directory" in buffer_state and args.replay_dir is None:
+                # the transitions of a disk buffer stay in its directory, so I reopen it
+                if args.prioritized:
+                    parser.error("the checkpoint's replay buffer is in %s, which --prioritized "
+                                 "can't use" % buffer_state["directory"])
+                args.replay_dir = buffer_state["directory"]
+                buffer = replay.DiskExperienceBuffer(args.replay_dir, REPLAY_SIZE)
+                print("Reopened the replay buffer in %s" % args.replay_dir)
+            if buffer_state is None:
+                print("The checkpoint has no replay buffer, it is refilled before training")
+            else:
+                buffer.load_state_dict(buffer_state)
+            frame_idx = state["frame_idx"]
+            epsilon = state["epsilon"]
+            total_rewards = state["total_rewards"]
+            best_mean_reward = state["best_mean_reward"]
+            last_sync_frame = state["last_sync_frame"]
+            optimizer_steps = state["optimizer_steps"]
+            np.random.set_state(state["numpy_rng"])
+            torch.set_rng_state(state["torch_rng"])
+            if args.cuda:
+                torch.cuda.set_rng_state(state["cuda_rng"])
+            # episodes that were running when the checkpoint was taken start over
+            print("Resumed from frame %d" % frame_idx)
+    last_checkpoint_frame = frame_idx
+    timer = instrumentation.PhaseTimer()
+    profile_window = instrumentation.ProfileWindow(
+        args.profile_start, args.profile_frames, args.profiler, path=args.env + "-profile")
+    if args.actors > 0:
+        # the actors act on the cpu with their own copies of the policy
+        ctx = mp.get_context("spawn")
+        shared_net = copy.deepcopy(net).cpu().share_memory()
+        weights_version = ctx.Value("i", 0)
+        epsilon_value = ctx.Value("d", epsilon)
+        exp_queue = ctx.Queue(maxsize=ACTOR_QUEUE_SIZE)
+        actors = [ctx.Process(target=play_actor, daemon=True,
+                              args=(actor_id, shared_net, weights_version, epsilon_value, exp_queue, args.envs))
+                  for actor_id in range(args.actors)]
+        for actor in actors:
+            actor.start()
+    else:
+        agent = make_agent(envs, buffer, timer)
+
+    ts_frame = frame_idx
+    ts = time.time()
+    last_timing_frame = frame_idx
 
     while True:
-        frame_idx += 1
-        epsilon = max(EPSILON_FINAL, EPSILON_START - frame_idx / EPSILON_DECAY_LAST_FRAME)
-
-        reward = agent.play_step(net, epsilon, device=device)
-        if reward is not None:
-            total_rewards.append(reward)
+        if args.actors > 0:
+            # frames are the transitions received; until training can start there is
+            # nothing else to do, so the learner waits for them
+            with timer.phase("receive_experience"):
+                frames, done_rewards = receive_experience(exp_queue, buffer, len(buffer) < REPLAY_START_SIZE)
+            frame_idx += frames
+            epsilon = max(EPSILON_FINAL, EPSILON_START - frame_idx / EPSILON_DECAY_LAST_FRAME)
+            epsilon_value.value = epsilon
+        else:
+            frame_idx += 1
+            epsilon = max(EPSILON_FINAL, EPSILON_START - frame_idx / EPSILON_DECAY_LAST_FRAME)
+            done_rewards = play_steps(agent, net, epsilon, device=device)
+        profile_window.step(frame_idx)
+        if frame_idx - last_timing_frame >= TIMING_EXPORT_FRAMES:
+            last_timing_frame = frame_idx
+            timer.export(writer, frame_idx)
+        solved = False
+        if done_rewards:
             speed = (frame_idx - ts_frame) / (time.time() - ts)
             ts_frame = frame_idx
             ts = time.time()
+        for reward in done_rewards:
+            total_rewards.append(reward)
             mean_reward = np.mean(total_rewards[-100:])
             print("%d: done %d games, mean reward %.3f, eps %.2f, speed %.2f f/s" % (
                 frame_idx, len(total_rewards), mean_reward, epsilon,
@@ -155,23 +419,83 @@ if __name__ == "__main__":
             writer.add_scalar("reward_100", mean_reward, frame_idx)
             writer.add_scalar("reward", reward, frame_idx)
             if best_mean_reward is None or best_mean_reward < mean_reward:
-                torch.save(net.state_dict(), args.env + "-best.dat")
+                # written by the checkpoint thread, the loop only copies the weights
+                checkpoints.save_file(args.env + "-best.dat", net.state_dict())
+                if args.replay_dir is not None:
+                    buffer.flush()
                 if best_mean_reward is not None:
                     print("Best mean reward updated %.3f -> %.3f, model saved" % (best_mean_reward, mean_reward))
                 best_mean_reward = mean_reward
             if mean_reward > args.reward:
                 print("Solved in %d frames!" % frame_idx)
+                solved = True
                 break
+        if solved:
+            break
+
+        if frame_idx - last_checkpoint_frame >= args.checkpoint_frames:
+            last_checkpoint_frame = frame_idx
+            with timer.phase("checkpoint"):
+                # the copy of an in-memory buffer is the slow part of a checkpoint, a disk
+                # buffer only flushes and names its directory
+                buffer_state = None
+                if args.checkpoint_buffer or args.replay_dir is not None:
+                    buffer_state = buffer.state_dict()
+                checkpoints.save({
+                    "net": net.state_dict(),
+                    "tgt_net": tgt_net.state_dict(),
+                    "optimizer": optimizer.state_dict(),
+                    "buffer": buffer_state,
+                    "frame_idx": frame_idx,
+                    "epsilon": epsilon,
+                    "total_rewards": total_rewards,
+                    "best_mean_reward": best_mean_reward,
+                    "last_sync_frame": last_sync_frame,
+                    "optimizer_steps": optimizer_steps,
+                    "numpy_rng": np.random.get_state(),
+                    "torch_rng": torch.get_rng_state(),
+                    "cuda_rng": torch.cuda.get_rng_state() if args.cuda else None,
+                }, frame_idx)
 
         if len(buffer) < REPLAY_START_SIZE:
             continue
 
-        if frame_idx % SYNC_TARGET_FRAMES == 0:
-            tgt_net.load_state_dict(net.state_dict())
+        # frame_idx moves by more than one per iteration with actors
+        if frame_idx - last_sync_frame >= SYNC_TARGET_FRAMES:
+            last_sync_frame = frame_idx
+            with timer.phase("target_sync"):
+                tgt_net.load_state_dict(net.state_dict())
 
         optimizer.zero_grad()
-        batch = buffer.sample(BATCH_SIZE)
-        loss_t = calc_loss(batch, net, tgt_net, device=device)
-        loss_t.backward()
-        optimizer.step()
+        if args.prioritized:
+            # beta goes to 1 so the correction is complete by the end of training
+            beta = min(1.0, BETA_START + frame_idx * (1.0 - BETA_START) / BETA_FRAMES)
+            with timer.phase("sample"):
+                batch, batch_indices, batch_weights = buffer.sample(BATCH_SIZE, beta, device=device)
+            with timer.phase("loss_forward"):
+                loss_t, td_errors = calc_loss(batch, net, tgt_net, device=device, weights=batch_weights)
+            with timer.phase("priority_update"):
+                buffer.update_priorities(batch_indices, td_errors.cpu().numpy())
+        else:
+            with timer.phase("sample"):
+                batch = buffer.sample(BATCH_SIZE, device=device)
+            with timer.phase("loss_forward"):
+                loss_t = calc_loss(batch, net, tgt_net, device=device)
+        with timer.phase("backward"):
+            loss_t.backward()
+        with timer.phase("optimizer_step"):
+            optimizer.step()
+        if args.actors > 0:
+            optimizer_steps += 1
+            if optimizer_steps % args.sync_interval == 0:
+                with weights_version.get_lock():
+                    shared_net.load_state_dict(net.state_dict())
+                    weights_version.value += 1
+    profile_window.close()
+    if args.actors > 0:
+        for actor in actors:
+            actor.terminate()
+    if args.replay_dir is not None:
+        buffer.flush()
+    checkpoints.close()
     writer.close()
\ No newline at end of file
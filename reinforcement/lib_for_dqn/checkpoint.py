@@ -0,0 +1,111 @@
+import copy
+import os
+import queue
+import re
+import threading
+
+import numpy as np
+import torch
+
+
+def snapshot(obj):
+    # copy of obj that later training steps can't change: tensors are cloned to the cpu
+    # and numpy arrays copied, inside dicts, lists and tuples. This is the only part of a
+    # save that runs on the training thread
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if isinstance(obj, dict):
+        return type(obj)((key, snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, "_fields"):
+        return type(obj)(snapshot(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+class CheckpointManager:
+    # Saves snapshots of the training state from a background thread, so the training
+    # loop only pays for the copy. Checkpoints are directory/checkpoint-<frame>.pt, each
+    # written to a temporary file and renamed, and only the newest keep are kept. A save
+    # that fails in the thread is raised by the next call on the training thread
+    PATTERN = re.compile(r"^checkpoint-(\d+)\.pt$")
+
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        self.jobs = queue.Queue()
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def _write_loop(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                path, state, rotate = job
+                temporary = path + ".tmp"
+                torch.save(state, temporary)
+                os.replace(temporary, path)
+                if rotate:
+                    self._rotate()
+            except Exception as error:
+                self.error = error
+            finally:
+                self.jobs.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _rotate(self):
+        for frame in self.frames()[:-self.keep]:
+            os.remove(self.path(frame))
+
+    def path(self, frame):
+        return os.path.join(self.directory, "checkpoint-%d.pt" % frame)
+
+    def frames(self):
+        # frames of the checkpoints on disk, oldest first
+        frames = []
+        for name in os.listdir(self.directory):
+            match = self.PATTERN.match(name)
+            if match:
+                frames.append(int(match.group(1)))
+        return sorted(frames)
+
+    def latest(self):
+        frames = self.frames()
+        return self.path(frames[-1]) if frames else None
+
+    def save(self, state, frame):
+        # state is a dict of state_dicts, arrays and plain values
+        self._raise_error()
+        self.jobs.put((self.path(frame), snapshot(state), True))
+
+    def save_file(self, path, obj):
+        # any other file written by the same thread, e.g. the best model so far
+        self._raise_error()
+        self.jobs.put((path, snapshot(obj), False))
+
+    def load(self, path=None, map_location="cpu"):
+        # the newest checkpoint unless path is given, or None when there is none
+        self.wait()
+        path = path or self.latest()
+        if path is None:
+            return None
+        # the checkpoints hold numpy arrays and rng states, not only tensors
+        return torch.load(path, map_location=map_location, weights_only=False)
+
+    def wait(self):
+        # block until everything queued so far is on disk
+        self.jobs.join()
+        self._raise_error()
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+        self._raise_error()
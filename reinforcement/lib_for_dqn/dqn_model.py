@@ -30,4 +30,36 @@ class DQN(nn.Module):
 
     def forward(self, x):
         conv_out = self.conv(x).view(x.size()[0], -1)
-        return self.fc(conv_out)
\ No newline at end of file
+        return self.fc(conv_out)
+
+
+class BranchingDQN(nn.Module):
+    # Small MLP for vector observations such as (age, wealth bucket) from the lifecycle
+    # env. Instead of one output per joint action there is one head per action dimension,
+    # each on top of a shared state value: Q_d(s, a) = V(s) + A_d(s, a) - mean_a A_d(s, a),
+    # so 6 + 190 outputs replace the 1140 of the joint equity x consumption choice
+    def __init__(self, low, high, branch_sizes, hidden_size=128):
+        super(BranchingDQN, self).__init__()
+        low = torch.as_tensor(np.asarray(low, dtype=np.float32))
+        high = torch.as_tensor(np.asarray(high, dtype=np.float32))
+        # the observation bounds are mapped to [-1, 1] inside the network
+        self.register_buffer("offset", (high + low) / 2)
+        self.register_buffer("scale", torch.clamp((high - low) / 2, min=1e-6))
+
+        self.trunk = nn.Sequential(
+            nn.Linear(low.numel(), hidden_size),
+            nn.ReLU(),
+            nn.Linear(hidden_size, hidden_size),
+            nn.ReLU()
+        )
+        self.value = nn.Linear(hidden_size, 1)
+        self.branches = nn.ModuleList([nn.Linear(hidden_size, size) for size in branch_sizes])
+
+    def forward(self, x):
+        hidden = self.trunk((x.float() - self.offset) / self.scale)
+        value = self.value(hidden)
+        q_values = []
+        for branch in self.branches:
+            advantage = branch(hidden)
+            q_values.append(value + advantage - advantage.mean(dim=1, keepdim=True))
+        return q_values
@@ -0,0 +1,85 @@
+import collections
+import contextlib
+import cProfile
+import time
+
+import numpy as np
+
+
+class PhaseTimer:
+    # Wall-clock time of each phase of the training loop (env step, action selection,
+    # sampling, backward, ...). Each `with timer.phase(name):` costs two perf_counter calls,
+    # and export() sends what was collected since the last export to the SummaryWriter
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.durations = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name].append(time.perf_counter() - start)
+
+    def export(self, writer, frame_idx):
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            durations = np.array(durations)
+            writer.add_histogram("phase/" + name, durations, frame_idx)
+            writer.add_scalar("phase_mean_ms/" + name, durations.mean() * 1000, frame_idx)
+            writer.add_scalar("phase_total_s/" + name, durations.sum(), frame_idx)
+        self.durations.clear()
+
+
+class ProfileWindow:
+    # Opt-in profiler that records frames [start, start + length) of the training loop,
+    # with torch.profiler (a chrome trace) or cProfile (a .prof file for pstats/snakeviz)
+    def __init__(self, start, length, kind="torch", path="profile"):
+        self.start = start
+        self.length = length
+        self.kind = kind
+        self.path = path
+        self.profiler = None
+        self.done = start is None
+
+    def step(self, frame_idx):
+        # call once per loop iteration with the current frame
+        if self.done:
+            return
+        if self.profiler is None and frame_idx >= self.start:
+            self._begin()
+        elif self.profiler is not None and frame_idx >= self.start + self.length:
+            self._end()
+
+    def _begin(self):
+        if self.kind == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            import torch.profiler
+            self.profiler = torch.profiler.profile(
+                activities=[torch.profiler.ProfilerActivity.CPU], record_shapes=True)
+            self.profiler.__enter__()
+
+    def _end(self):
+        if self.kind == "cprofile":
+            self.profiler.disable()
+            self.profiler.dump_stats(self.path + ".prof")
+            print("cProfile stats written to %s.prof" % self.path)
+        else:
+            self.profiler.__exit__(None, None, None)
+            self.profiler.export_chrome_trace(self.path + ".json")
+            print(self.profiler.key_averages().table(sort_by="cpu_time_total", row_limit=15))
+            print("torch.profiler trace written to %s.json" % self.path)
+        self.profiler = None
+        self.done = True
+
+    def close(self):
+        # stop a window that is still open when training ends
+        if self.profiler is not None:
+            self._end()
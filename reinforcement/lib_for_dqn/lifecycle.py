@@ -1,7 +1,6 @@
 import gym
 from gym.spaces import Box
 import numpy as np
-import random
 
 
 class LifecycleEnv(gym.Env):
@@ -10,7 +9,8 @@ class LifecycleEnv(gym.Env):
                  mortality_profile,
                  consumption_shock=0.5,
                  minimum_consumption=0.1,
-                 risk_premium=0.05):
+                 risk_premium=0.05,
+                 seed=None):
         # Set starting variables
         self.starting_wealth = 1
         self.wealth = self.starting_wealth
@@ -34,6 +34,16 @@ class LifecycleEnv(gym.Env):
                                      shape=(2,))
         # Here we define the choices on consumption and equity allocation as continuos actions
         self.action_space = Box(np.array([-1, -1]), np.array([1, 1]))
+        # every env owns its random stream, so copies in other processes never share state
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def draw_episode(self, rng):
+        # the return and mortality shocks of a whole episode, drawn at reset instead of
+        # two calls per step. An episode can't go past the last age with a mortality rate
+        length = len(self.mortality) - self.starting_age
+        return (rng.normal(self.equity_return, self.equity_volatility, length),
+                rng.random(length))
 
     def step(self, action):
         done = False
@@ -41,8 +51,7 @@ class LifecycleEnv(gym.Env):
         action_equity_allocation = (action[0] + 1) / 2
         action_consumption = ((action[1] + 1) / 2)
         # Apply action
-        self.risk_return = np.random.normal(
-            self.equity_return, self.equity_volatility, 1)[0]
+        self.risk_return = self.risk_returns[self.age - self.starting_age]
         portfolio_return = ((self.risk_return * action_equity_allocation) +
                             (self.risk_free_return * (1 - action_equity_allocation)))
         # Here income is added only after the portfolio return
@@ -62,7 +71,7 @@ class LifecycleEnv(gym.Env):
             self.wealth = 0
             reward = -100
             done = True
-        if random.random() < self.mortality[self.age]:
+        if self.death_draws[self.age - self.starting_age] < self.mortality[self.age]:
             done = True
         self.last_consumption = action_consumption
         info = {"age": self.age,
@@ -82,10 +91,153 @@ class LifecycleEnv(gym.Env):
         # no urgent need for this
         pass
 
-    def reset(self):
+    def reset(self, seed=None):
+        # a seed (an int or a SeedSequence) restarts the random stream
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self.risk_returns, self.death_draws = self.draw_episode(self.rng)
         # Resetting age and wealth
         self.wealth = self.starting_wealth
         self.age = self.starting_age
         self.last_consumption = self.minimum_consumption
         state = np.array([self.age, self.wealth], dtype=np.float32)
         return state
+
+
+try:
+    from stable_baselines3.common.vec_env import VecEnv
+except ImportError:
+    # stable-baselines is only needed for PPO, without it the batch env is a plain class
+    # with the same interface
+    VecEnv = object
+
+
+class BatchLifecycleEnv(VecEnv):
+    # N copies of LifecycleEnv stepped together: age, wealth and last consumption are
+    # arrays of shape (N,) and all the shocks of a step come from one draw. Finished
+    # agents are reset straight away, as stable-baselines expects from a VecEnv
+    def __init__(self,
+                 num_envs,
+                 income_profile,
+                 mortality_profile,
+                 consumption_shock=0.5,
+                 minimum_consumption=0.1,
+                 risk_premium=0.05,
+                 seed=None):
+        # I keep a single env around for the constants and the spaces
+        self.env = LifecycleEnv(income_profile,
+                                mortality_profile,
+                                consumption_shock=consumption_shock,
+                                minimum_consumption=minimum_consumption,
+                                risk_premium=risk_premium)
+        self.income = np.asarray(income_profile, dtype=np.float64)
+        self.mortality = np.asarray(mortality_profile, dtype=np.float64)
+        if VecEnv is object:
+            self.num_envs = num_envs
+            self.observation_space = self.env.observation_space
+            self.action_space = self.env.action_space
+        else:
+            super().__init__(num_envs, self.env.observation_space, self.env.action_space)
+        self.age = np.full(num_envs, self.env.starting_age, dtype=np.int64)
+        self.wealth = np.full(num_envs, self.env.starting_wealth, dtype=np.float64)
+        self.last_consumption = np.full(num_envs, self.env.minimum_consumption, dtype=np.float64)
+        self.actions = None
+        self.seed(seed)
+
+    def _observation(self):
+        return np.stack([self.age, self.wealth], axis=1).astype(np.float32)
+
+    def _reset_agents(self, indices):
+        for index in indices:
+            self.risk_returns[index], self.death_draws[index] = self.env.draw_episode(self.rngs[index])
+        self.age[indices] = self.env.starting_age
+        self.wealth[indices] = self.env.starting_wealth
+        self.last_consumption[indices] = self.env.minimum_consumption
+
+    def reset(self, seed=None):
+        # seeding starts fresh episodes already
+        if seed is not None:
+            self.seed(seed)
+        else:
+            self._reset_agents(np.arange(self.num_envs))
+        return self._observation()
+
+    def step_async(self, actions):
+        self.actions = np.asarray(actions, dtype=np.float64).reshape(self.num_envs, 2)
+
+    def step_wait(self):
+        env = self.env
+        # same transformation and transition as LifecycleEnv.step, one row per agent
+        equity_allocation = (self.actions[:, 0] + 1) / 2
+        consumption = (self.actions[:, 1] + 1) / 2
+        agents = np.arange(self.num_envs)
+        step_index = self.age - env.starting_age
+        risk_return = self.risk_returns[agents, step_index]
+        portfolio_return = risk_return * equity_allocation + env.risk_free_return * (1 - equity_allocation)
+        self.wealth = (1 + portfolio_return) * (self.wealth - consumption) + self.income[self.age]
+        rewards = consumption * ((1 + env.long_term_consumption_premium) ** (self.age - 20))
+        # the penalties overwrite each other in the same order as in the single env
+        rewards[np.abs(consumption - self.last_consumption) > env.consumption_shock] = -10
+        under_consumed = consumption < env.minimum_consumption
+        broke = self.wealth < 0
+        self.wealth[broke] = 0
+        rewards[under_consumed | broke] = -100
+        dead = self.death_draws[agents, step_index] < self.mortality[self.age]
+        dones = under_consumed | broke | dead
+        self.last_consumption = consumption
+        observations = self._observation()
+        self.age += 1
+
+        infos = [{} for _ in range(self.num_envs)]
+        finished = np.flatnonzero(dones)
+        if len(finished):
+            for index in finished:
+                infos[index]["terminal_observation"] = observations[index].copy()
+            self._reset_agents(finished)
+            observations[finished] = (env.starting_age, env.starting_wealth)
+        return observations, rewards.astype(np.float32), dones, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        pass
+
+    def _indices(self, indices):
+        if indices is None:
+            return range(self.num_envs)
+        if isinstance(indices, int):
+            return [indices]
+        return indices
+
+    def get_attr(self, attr_name, indices=None):
+        # the agents share every attribute except the state arrays
+        value = getattr(self, attr_name) if hasattr(self, attr_name) else getattr(self.env, attr_name)
+        if isinstance(value, np.ndarray) and value.shape[:1] == (self.num_envs,):
+            return [value[index] for index in self._indices(indices)]
+        return [value for _ in self._indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        if hasattr(self, attr_name) and isinstance(getattr(self, attr_name), np.ndarray):
+            getattr(self, attr_name)[list(self._indices(indices))] = value
+        else:
+            setattr(self.env, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.env, method_name)(*method_args, **method_kwargs)
+                for _ in self._indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._indices(indices)]
+
+    def seed(self, seed=None):
+        # agent i always gets the i-th child of the seed, so a run is the same whether the
+        # agents sit in one batch env or are spread over single envs in several processes
+        children = np.random.SeedSequence(seed).spawn(self.num_envs)
+        self.rngs = [np.random.default_rng(child) for child in children]
+        length = len(self.mortality) - self.env.starting_age
+        self.risk_returns = np.empty((self.num_envs, length))
+        self.death_draws = np.empty((self.num_envs, length))
+        self._reset_agents(np.arange(self.num_envs))
+        return children
@@ -17,7 +17,9 @@ class LifecycleEnv(gym.Env):
         self.max_wealth = 10000
         self.wealth_buckets = 500
         # Here we create our observation space
-        self.observation_space = Dict({"age": Discrete(self.terminal_age - self.starting_age + 1), "wealth_bucket": Discrete(self.wealth_buckets)})
+        # step returns the age after the birthday, so ages go from starting_age up to
+        # terminal_age + 1
+        self.observation_space = Dict({"age": Discrete(self.terminal_age - self.starting_age + 2, start=self.starting_age), "wealth_bucket": Discrete(self.wealth_buckets)})
 
     def step(self, action):
         reward = 0
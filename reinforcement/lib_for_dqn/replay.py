@@ -0,0 +1,445 @@
+import collections
+import json
+import os
+
+import numpy as np
+import torch
+
+
+Experience = collections.namedtuple('Experience', field_names=['state', 'action', 'reward', 'done', 'new_state'])
+
+
+class ExperienceBuffer:
+    # Ring buffer kept as one preallocated array per field instead of a deque of
+    # namedtuples. The arrays are created on the first append, when the shapes and dtypes
+    # of states and actions are known, and then written in place
+    def __init__(self, capacity, seed=None):
+        self.capacity = capacity
+        self.position = 0
+        self.size = 0
+        self.rng = np.random.default_rng(seed)
+        self.states = None
+
+    def __len__(self):
+        return self.size
+
+    def _allocate(self, state, action):
+        state = np.asarray(state)
+        action = np.asarray(action)
+        self.states = np.empty((self.capacity,) + state.shape, dtype=state.dtype)
+        self.next_states = np.empty_like(self.states)
+        self.actions = np.empty((self.capacity,) + action.shape, dtype=action.dtype)
+        self.rewards = np.empty(self.capacity, dtype=np.float32)
+        self.dones = np.empty(self.capacity, dtype=np.uint8)
+
+    def _advance(self, count):
+        # the slots the next count transitions go to, wrapping around the end
+        indices = (self.position + np.arange(count)) % self.capacity
+        self.position = (self.position + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        return indices
+
+    def append(self, experience):
+        state, action, reward, done, next_state = experience
+        if self.states is None:
+            self._allocate(state, action)
+        index = self.position
+        self.states[index] = state
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.dones[index] = done
+        self.next_states[index] = next_state
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return index
+
+    def append_batch(self, states, actions, rewards, dones, next_states):
+        # one transition per row, e.g. straight from BatchLifecycleEnv.step
+        if self.states is None:
+            self._allocate(states[0], actions[0])
+        if len(states) > self.capacity:
+            # only the newest capacity rows would survive anyway
+            start = len(states) - self.capacity
+            states, actions, rewards = states[start:], actions[start:], rewards[start:]
+            dones, next_states = dones[start:], next_states[start:]
+        indices = self._advance(len(states))
+        self.states[indices] = states
+        self.actions[indices] = actions
+        self.rewards[indices] = rewards
+        self.dones[indices] = dones
+        self.next_states[indices] = next_states
+        return indices
+
+    def gather(self, indices, device=None):
+        batch = (self.states[indices], self.actions[indices], self.rewards[indices],
+                 self.dones[indices], self.next_states[indices])
+        if device is None:
+            return batch
+        # fancy indexing already made fresh arrays, so torch can take them over as they are
+        return tuple(torch.from_numpy(array).to(device) for array in batch)
+
+    def sample(self, batch_size, device=None):
+        # sampling with replacement is O(batch_size), whereas replace=False permuted the
+        # whole buffer on every call. With a device the batch comes back as tensors on it
+        indices = self.rng.integers(0, self.size, batch_size)
+        return self.gather(indices, device)
+
+    def state_dict(self):
+        # references to the arrays, like a torch state_dict; checkpoint.snapshot copies them
+        state = {"capacity": self.capacity, "position": self.position, "size": self.size,
+                 "rng": self.rng.bit_generator.state}
+        if self.states is not None:
+            for field in ("states", "actions", "rewards", "dones", "next_states"):
+                state[field] = getattr(self, field)
+        return state
+
+    def load_state_dict(self, state):
+        if "directory" in state:
+            raise ValueError("checkpoint buffer is on disk in %s, open it as a DiskExperienceBuffer"
+                             % state["directory"])
+        if state["capacity"] != self.capacity:
+            raise ValueError("checkpoint buffer has capacity %d, not %d" % (state["capacity"], self.capacity))
+        self.position = state["position"]
+        self.size = state["size"]
+        self.rng.bit_generator.state = state["rng"]
+        if "states" in state:
+            for field in ("states", "actions", "rewards", "dones", "next_states"):
+                setattr(self, field, state[field])
+
+
+class SumTree:
+    # binary tree of priorities kept in one flat array: node i has children 2i and 2i+1,
+    # the root is node 1 and the leaves start at self.leaves. I round the number of
+    # leaves up to a power of two so every leaf is at the same depth
+    def __init__(self, capacity):
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.depth = self.leaves.bit_length() - 1
+        self.nodes = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    def total(self):
+        return self.nodes[1]
+
+    def update(self, indices, priorities):
+        # set a batch of leaves, then recompute their ancestors one level at a time, so a
+        # batch costs O(batch * log n) and repeated indices are handled by np.unique
+        nodes = np.asarray(indices) + self.leaves
+        self.nodes[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.nodes[nodes] = self.nodes[2 * nodes] + self.nodes[2 * nodes + 1]
+
+    def find(self, values):
+        # for each value in [0, total) walk down to the leaf whose cumulative priority
+        # interval contains it, all values together
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            go_right = values >= self.nodes[left]
+            values = np.where(go_right, values - self.nodes[left], values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.leaves
+
+
+class PrioritizedExperienceBuffer(ExperienceBuffer):
+    # proportional prioritized replay: transitions are sampled with probability
+    # p ** alpha / sum(p ** alpha), where p is the last absolute TD error seen for them,
+    # and the importance-sampling weights undo that bias in the loss
+    def __init__(self, capacity, alpha=0.6, epsilon=1e-5, seed=None):
+        super(PrioritizedExperienceBuffer, self).__init__(capacity, seed=seed)
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def append(self, experience):
+        # new transitions get the largest priority so far, so each one is replayed at
+        # least once before its TD error is known
+        index = super(PrioritizedExperienceBuffer, self).append(experience)
+        self.tree.update([index], self.max_priority)
+        return index
+
+    def append_batch(self, states, actions, rewards, dones, next_states):
+        indices = super(PrioritizedExperienceBuffer, self).append_batch(
+            states, actions, rewards, dones, next_states)
+        self.tree.update(indices, self.max_priority)
+        return indices
+
+    def sample(self, batch_size, beta=0.4, device=None):
+        # one value from each of batch_size equal slices of the total priority
+        total = self.tree.total()
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * (total / batch_size)
+        indices = self.tree.find(np.minimum(values, np.nextafter(total, 0)))
+        # a leaf past the filled part has priority 0 and can't be found, the clip only
+        # guards against rounding in the float sums
+        indices = np.minimum(indices, self.size - 1)
+        probabilities = self.tree.nodes[indices + self.tree.leaves] / total
+        weights = (self.size * probabilities) ** -beta
+        weights = (weights / weights.max()).astype(np.float32)
+        if device is not None:
+            weights = torch.from_numpy(weights).to(device)
+        return self.gather(indices, device), indices, weights
+
+    def update_priorities(self, indices, td_errors):
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
+
+    def state_dict(self):
+        state = super(PrioritizedExperienceBuffer, self).state_dict()
+        state["priorities"] = self.tree.nodes
+        state["max_priority"] = self.max_priority
+        return state
+
+    def load_state_dict(self, state):
+        super(PrioritizedExperienceBuffer, self).load_state_dict(state)
+        if "priorities" in state:
+            self.tree.nodes = state["priorities"]
+            self.max_priority = state["max_priority"]
+        else:
+            # from a uniform buffer: every stored transition gets replayed as if new
+            self.tree.update(np.arange(self.size), self.max_priority)
+
+
+class DiskExperienceBuffer(ExperienceBuffer):
+    # The same ring buffer with its arrays in .npy files opened as memory maps, so it can
+    # be larger than RAM, survive the run and be read by other processes without copies.
+    # index.json holds the ring position and every episode as (start, length, stride),
+    # counted in transitions appended since the buffer was created: stride is 1 for
+    # single appends and the number of rows for append_batch, whose rows interleave the
+    # agents of a vectorised env.
+    # The transitions are in the units of the env that produced them (the discrete
+    # lifecycle env's age and wealth bucket for dqn.py), which have no mapping to the
+    # wealth of the dynamic_programming model, so comparing stored agents with a DP
+    # policy through evaluation.py is left out; episode() is the reader for that
+    FIELDS = ("states", "actions", "rewards", "dones", "next_states")
+
+    def __init__(self, directory, capacity=None, seed=None, read_only=False):
+        super(DiskExperienceBuffer, self).__init__(capacity, seed=seed)
+        self.directory = directory
+        self.read_only = read_only
+        self.total = 0
+        self.episode_start = 0
+        self.episodes = []
+        # start of the running episode of every row of append_batch
+        self.lane_starts = None
+        if os.path.exists(self._index_path()):
+            self._load()
+        elif read_only:
+            raise FileNotFoundError("no replay buffer in %s" % directory)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def open(cls, directory, seed=None):
+        # read-only view of a buffer written by another run or process
+        return cls(directory, seed=seed, read_only=True)
+
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _field_path(self, field):
+        return os.path.join(self.directory, field + ".npy")
+
+    def _load(self):
+        with open(self._index_path()) as index_file:
+            index = json.load(index_file)
+        self.capacity = index["capacity"]
+        self.position = index["position"]
+        self.size = index["size"]
+        self.total = index["total"]
+        self.episode_start = index["episode_start"]
+        # indexes written before batches were indexed have no stride
+        self.episodes = [tuple(episode) if len(episode) == 3 else tuple(episode) + (1,)
+                         for episode in index["episodes"]]
+        self.lane_starts = index.get("lane_starts")
+        mode = "r" if self.read_only else "r+"
+        for field in self.FIELDS:
+            setattr(self, field, np.load(self._field_path(field), mmap_mode=mode))
+
+    def _allocate(self, state, action):
+        state = np.asarray(state)
+        action = np.asarray(action)
+        shapes = {"states": (state.shape, state.dtype),
+                  "actions": (action.shape, action.dtype),
+                  "rewards": ((), np.float32),
+                  "dones": ((), np.uint8),
+                  "next_states": (state.shape, state.dtype)}
+        for field in self.FIELDS:
+            shape, dtype = shapes[field]
+            setattr(self, field, np.lib.format.open_memmap(
+                self._field_path(field), mode="w+", dtype=dtype, shape=(self.capacity,) + shape))
+
+    def append(self, experience):
+        index = super(DiskExperienceBuffer, self).append(experience)
+        self.total += 1
+        if experience[3]:
+            self.episodes.append((self.episode_start, self.total - self.episode_start, 1))
+            self.episode_start = self.total
+        self.lane_starts = None
+        return index
+
+    def append_batch(self, states, actions, rewards, dones, next_states):
+        # row k of every batch is the same agent, as BatchAgent appends them, so an
+        # agent's episode is every len(states)-th transition from its start. When the
+        # number of rows changes, the episodes that were running aren't indexed
+        first = self.total
+        rows = len(states)
+        if self.lane_starts is None or len(self.lane_starts) != rows:
+            self.lane_starts = [first + row for row in range(rows)]
+        indices = super(DiskExperienceBuffer, self).append_batch(
+            states, actions, rewards, dones, next_states)
+        for row in np.flatnonzero(dones).tolist():
+            start = self.lane_starts[row]
+            self.episodes.append((start, (first + row - start) // rows + 1, rows))
+            self.lane_starts[row] = first + row + rows
+        self.total += rows
+        self.episode_start = self.total
+        return indices
+
+    def stored_episodes(self):
+        # episodes whose transitions haven't been overwritten yet, oldest first
+        oldest = self.total - self.size
+        self.episodes = [episode for episode in self.episodes if episode[0] >= oldest]
+        return self.episodes
+
+    def episode(self, number, device=None):
+        # the transitions of one stored episode, in order
+        start, length, stride = self.stored_episodes()[number]
+        return self.gather((start + stride * np.arange(length)) % self.capacity, device)
+
+    def flush(self):
+        # push the pages to disk and write the index next to them, through a temporary
+        # file so a crash never leaves an index that doesn't match the arrays
+        if self.states is None:
+            return
+        for field in self.FIELDS:
+            getattr(self, field).flush()
+        index = {"capacity": self.capacity,
+                 "position": self.position,
+                 "size": self.size,
+                 "total": self.total,
+                 "episode_start": self.episode_start,
+                 "episodes": self.stored_episodes(),
+                 "lane_starts": self.lane_starts}
+        temporary = self._index_path() + ".tmp"
+        with open(temporary, "w") as index_file:
+            json.dump(index, index_file)
+        os.replace(temporary, self._index_path())
+
+    def state_dict(self):
+        # the transitions are already on disk, so a checkpoint only flushes them and
+        # keeps the sampling rng; the buffer itself is reopened from its directory
+        self.flush()
+        return {"directory": self.directory, "rng": self.rng.bit_generator.state}
+
+    def load_state_dict(self, state):
+        if "directory" not in state:
+            raise ValueError("checkpoint buffer was kept in memory, its transitions aren't in %s"
+                             % self.directory)
+        self.rng.bit_generator.state = state["rng"]
+
+
+class FrameStackExperienceBuffer(ExperienceBuffer):
+    # Replay for stacked-frame observations (wrappers.BufferWrapper) that keeps each frame
+    # once. Slot i stores the newest frame of transition i's next state, and the step of
+    # the transition within its episode; the stacks are rebuilt at sample time from the
+    # frames of the previous slots, with zeros before the start of the episode as the
+    # wrapper does. The first frame of each episode isn't any transition's next frame and
+    # is kept aside. Transitions must be appended one at a time, in the order played
+    def __init__(self, capacity, n_steps, seed=None):
+        super(FrameStackExperienceBuffer, self).__init__(capacity, seed=seed)
+        self.n_steps = n_steps
+        self.first_frames = {}
+        self.episode_step = 0
+        self.frames = None
+
+    def _newest_frame(self, stack):
+        if hasattr(stack, "frames"):
+            return np.asarray(stack.frames[-1])
+        stack = np.asarray(stack)
+        return stack[-(len(stack) // self.n_steps):]
+
+    def append(self, experience):
+        state, action, reward, done, next_state = experience
+        next_frame = self._newest_frame(next_state)
+        if self.frames is None:
+            self.frames = np.empty((self.capacity,) + next_frame.shape, dtype=next_frame.dtype)
+            self.actions = np.empty((self.capacity,) + np.shape(action), dtype=np.asarray(action).dtype)
+            self.rewards = np.empty(self.capacity, dtype=np.float32)
+            self.dones = np.empty(self.capacity, dtype=np.uint8)
+            self.steps = np.empty(self.capacity, dtype=np.int64)
+        index = self.position
+        self.first_frames.pop(index, None)
+        if self.episode_step == 0:
+            self.first_frames[index] = self._newest_frame(state)
+        self.frames[index] = next_frame
+        self.actions[index] = action
+        self.rewards[index] = reward
+        self.dones[index] = done
+        self.steps[index] = self.episode_step
+        self.episode_step = 0 if done else self.episode_step + 1
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return index
+
+    def append_batch(self, states, actions, rewards, dones, next_states):
+        # the rows of a vectorised env interleave its agents, so the previous slot would
+        # hold another agent's frame and every rebuilt stack would mix episodes
+        raise TypeError("frame stacks are rebuilt from consecutive slots, append one env's steps in order")
+
+    def state_dict(self):
+        # the frames replace the states arrays of the base buffer, which stay None here, so
+        # without them (and the steps, first frames and running episode step) a resumed
+        # buffer would lose every stored transition and the stack of the running episode
+        state = super(FrameStackExperienceBuffer, self).state_dict()
+        state["n_steps"] = self.n_steps
+        state["episode_step"] = self.episode_step
+        state["first_frames"] = self.first_frames
+        if self.frames is not None:
+            for field in ("frames", "actions", "rewards", "dones", "steps"):
+                state[field] = getattr(self, field)
+        return state
+
+    def load_state_dict(self, state):
+        if state.get("n_steps") != self.n_steps:
+            raise ValueError("checkpoint buffer stacks %s frames, not %d" % (state.get("n_steps"), self.n_steps))
+        super(FrameStackExperienceBuffer, self).load_state_dict(state)
+        self.episode_step = state["episode_step"]
+        self.first_frames = dict(state["first_frames"])
+        if "frames" in state:
+            for field in ("frames", "actions", "rewards", "dones", "steps"):
+                setattr(self, field, state[field])
+
+    def _stack(self, indices, steps, newest):
+        # frames of observations newest - n_steps + 1 .. newest of the episode, where
+        # observation k > 0 is the next frame of slot i - steps + k - 1 and observation 0
+        # was kept aside for slot i - steps
+        batch = np.zeros((len(indices), self.n_steps) + self.frames.shape[1:], dtype=self.frames.dtype)
+        for position in range(self.n_steps):
+            observation = newest - (self.n_steps - 1 - position)
+            later = observation > 0
+            slots = (indices - steps + observation - 1) % self.capacity
+            batch[later, position] = self.frames[slots[later]]
+            for row in np.flatnonzero(observation == 0):
+                batch[row, position] = self.first_frames[(indices[row] - steps[row]) % self.capacity]
+        return batch.reshape((len(indices), -1) + self.frames.shape[2:])
+
+    def gather(self, indices, device=None):
+        steps = self.steps[indices]
+        batch = (self._stack(indices, steps, steps), self.actions[indices], self.rewards[indices],
+                 self.dones[indices], self._stack(indices, steps, steps + 1))
+        if device is None:
+            return batch
+        return tuple(torch.from_numpy(array).to(device) for array in batch)
+
+    def sample(self, batch_size, device=None):
+        # once the ring has wrapped, the oldest n_steps slots may have lost the frames
+        # their stacks start with, so they aren't sampled
+        if self.size < self.capacity:
+            indices = self.rng.integers(0, self.size, batch_size)
+        else:
+            indices = (self.position + self.rng.integers(self.n_steps, self.capacity, batch_size)) % self.capacity
+        return self.gather(indices, device)
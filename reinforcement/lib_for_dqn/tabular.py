@@ -0,0 +1,118 @@
+import numpy as np
+
+from lib_for_dqn import lifecycle_discrete
+
+
+# constants of lifecycle_discrete.LifecycleEnv.step that aren't attributes of the env
+RISK_RETURN = 0.05
+RISK_FREE_RETURN = 0.01
+EQUITY_STEP = 5
+CONSUMPTION_OFFSET = 10
+RUIN_PENALTY = -10000
+
+
+class TabularSolution:
+    # optimal values and actions of the bucketed lifecycle MDP: rows are the ages from
+    # the env's starting age to its terminal age, columns the wealth buckets. values has
+    # one more row, the value after the terminal age
+    def __init__(self, ages, values, equity_action, consumption_action, bucket_wealth):
+        self.ages = np.asarray(ages)
+        self.values = values
+        self.equity_action = equity_action
+        self.consumption_action = consumption_action
+        self.bucket_wealth = bucket_wealth
+
+    def row(self, age):
+        return int(age - self.ages[0])
+
+    def action(self, age, bucket):
+        # in the env's dict format
+        row = self.row(age)
+        return {"equity_allocation": int(self.equity_action[row, bucket]),
+                "consumption": int(self.consumption_action[row, bucket])}
+
+
+def _bucket(env, wealth, wealth_states=None):
+    # same bucketing as the observation returned by step, with wealth_states buckets
+    if wealth_states is None:
+        wealth_states = env.wealth_buckets
+    return np.minimum((wealth / (env.max_wealth + 1) * wealth_states).astype(np.int64),
+                      wealth_states - 1)
+
+
+def solve(env=None, discount=1.0, chunk_size=100, wealth_states=None):
+    # Backward induction over (age, wealth bucket) with every bucket standing for the
+    # wealth at its middle. By default there are max_wealth + 1 buckets, one unit of
+    # wealth each, and the values are within about 0.1% of what the policy earns in the
+    # env. With fewer buckets, e.g. the env's wealth_buckets, the middles overstate the
+    # wealth of most states and values[0] is far above the rollout (16072 against 5207
+    # with 500), so check those policies with rollout. The transitions of all
+    # (bucket, equity, consumption) triples are built once, chunk_size buckets at a
+    # time, as the next bucket (the smallest integer type that holds it) and a ruin mask,
+    # one pair with income and one without; no float table of the whole state space is
+    # kept. Each age is a vectorized max over the actions, again chunk_size buckets at a
+    # time, with the reward consumption + RUIN_PENALTY * ruined.
+    # The quirks of step are kept: the income stops for good at the retirement age, ruin
+    # costs RUIN_PENALTY but the episode goes on with zero wealth (done is overwritten),
+    # and the step at the terminal age pays nothing
+    if env is None:
+        env = lifecycle_discrete.LifecycleEnv()
+    if wealth_states is None:
+        wealth_states = env.max_wealth + 1
+    n_equity = env.action_space["equity_allocation"].n
+    n_consumption = env.action_space["consumption"].n
+    bucket_width = (env.max_wealth + 1) / wealth_states
+    bucket_wealth = (np.arange(wealth_states) + 0.5) * bucket_width
+
+    equity = np.arange(n_equity) / EQUITY_STEP
+    growth = 1 + RISK_RETURN * equity + RISK_FREE_RETURN * (1 - equity)
+    consumption = np.arange(n_consumption) + CONSUMPTION_OFFSET
+    # (bucket, equity, consumption)
+    shape = (wealth_states, n_equity, n_consumption)
+    next_buckets = {}
+    ruined = {}
+    for income in (env.starting_income, 0):
+        next_buckets[income] = np.empty(shape, dtype=np.min_scalar_type(wealth_states - 1))
+        ruined[income] = np.empty(shape, dtype=bool)
+        for start in range(0, wealth_states, chunk_size):
+            stop = min(start + chunk_size, wealth_states)
+            savings = bucket_wealth[start:stop, np.newaxis, np.newaxis] - consumption[np.newaxis, np.newaxis, :]
+            new_wealth = growth[np.newaxis, :, np.newaxis] * savings + income
+            ruined[income][start:stop] = new_wealth < 0
+            next_buckets[income][start:stop] = _bucket(env, np.maximum(new_wealth, 0), wealth_states)
+
+    ages = np.arange(env.starting_age, env.terminal_age + 1)
+    values = np.zeros((len(ages) + 1, wealth_states))
+    equity_action = np.zeros((len(ages), wealth_states), dtype=np.int64)
+    consumption_action = np.zeros((len(ages), wealth_states), dtype=np.int64)
+    for row in range(len(ages) - 1, -1, -1):
+        age = ages[row]
+        if age == env.terminal_age:
+            # reward 0 and done whatever the action, so the value stays 0
+            continue
+        income = 0 if age >= env.retirement_age else env.starting_income
+        for start in range(0, wealth_states, chunk_size):
+            stop = min(start + chunk_size, wealth_states)
+            rewards = consumption + RUIN_PENALTY * ruined[income][start:stop]
+            q_values = rewards + discount * values[row + 1][next_buckets[income][start:stop]]
+            q_values = q_values.reshape(stop - start, -1)
+            best = q_values.argmax(axis=1)
+            values[row, start:stop] = q_values[np.arange(stop - start), best]
+            equity_action[row, start:stop], consumption_action[row, start:stop] = np.unravel_index(
+                best, (n_equity, n_consumption))
+    return TabularSolution(ages, values, equity_action, consumption_action, bucket_wealth)
+
+
+def rollout(solution, env=None):
+    # play the tabular policy in the env itself, with the true wealth rather than the
+    # bucket middle, and return the total reward
+    if env is None:
+        env = lifecycle_discrete.LifecycleEnv()
+    env.reset()
+    total_reward = 0.0
+    done = False
+    while not done:
+        bucket = int(_bucket(env, np.array(env.wealth), len(solution.bucket_wealth)))
+        _, reward, done, _ = env.step(solution.action(env.age, bucket))
+        total_reward += reward
+    return total_reward
@@ -1,4 +1,3 @@
-import cv2
 import gym
 import gym.spaces
 import numpy as np
@@ -30,31 +29,94 @@ class MaxAndSkipEnv(gym.Wrapper):
     def __init__(self, env=None, skip=4):
         """Return only every `skip`-th frame"""
         super(MaxAndSkipEnv, self).__init__(env)
-        # most recent raw observations (for max pooling across time steps)
-        self._obs_buffer = collections.deque(maxlen=2)
+        # the two most recent raw observations (for max pooling across time steps), copied
+        # into two preallocated slots
+        self._obs_buffer = None
+        self._filled = 0
+        self._next_slot = 0
         self._skip = skip
 
+    def _store(self, obs):
+        if self._obs_buffer is None or self._obs_buffer.shape[1:] != np.shape(obs):
+            obs = np.asarray(obs)
+            self._obs_buffer = np.empty((2,) + obs.shape, dtype=obs.dtype)
+        np.copyto(self._obs_buffer[self._next_slot], obs)
+        self._next_slot = 1 - self._next_slot
+        self._filled = min(self._filled + 1, 2)
+
     def step(self, action):
         total_reward = 0.0
         done = None
         for _ in range(self._skip):
             obs, reward, done, info = self.env.step(action)
-            self._obs_buffer.append(obs)
+            self._store(obs)
             total_reward += reward
             if done:
                 break
-        max_frame = np.max(np.stack(self._obs_buffer), axis=0)
+        # every step returns a new frame: LazyFrames and the replay buffer keep references
+        # to the frames they were given, so the slots are never handed out
+        if self._filled == 2:
+            max_frame = np.maximum(self._obs_buffer[0], self._obs_buffer[1])
+        else:
+            max_frame = self._obs_buffer[1 - self._next_slot].copy()
         return max_frame, total_reward, done, info
 
     def reset(self):
         """Clear past frame buffer and init. to first obs. from inner env."""
-        self._obs_buffer.clear()
+        self._filled = 0
         obs = self.env.reset()
-        self._obs_buffer.append(obs)
+        self._store(obs)
         return obs
 
 
+class FramePreprocessor:
+    def __init__(self):
+        """Grayscale, resize to 84x110 and crop to 84x84 a stack of (N, H, W, 3) frames, reusing the buffers."""
+        self.buffers = {}
+
+    def _buffers(self, frames_shape):
+        # the frames sit on the channel axis in groups of up to RESIZE_CHANNELS, so each
+        # cv2 call resizes a whole group
+        if frames_shape not in self.buffers:
+            n, height, width = frames_shape[:3]
+            groups = -(-n // self.RESIZE_CHANNELS)
+            channels = min(n, self.RESIZE_CHANNELS)
+            self.buffers[frames_shape] = (np.empty((groups, height, width, channels), dtype=np.float32),
+                                          np.empty((height, width, channels), dtype=np.float32),
+                                          np.empty((groups, 110, 84, channels), dtype=np.float32))
+        return self.buffers[frames_shape]
+
+    # cv2's INTER_AREA resize takes at most 4 channels
+    RESIZE_CHANNELS = 4
+
+    def __call__(self, frames, out=None):
+        # cv2 is imported here so that importing the wrappers for the lifecycle env
+        # doesn't load it
+        import cv2
+
+        frames = np.asarray(frames)
+        if out is None:
+            out = np.empty((len(frames), 84, 84, 1), dtype=np.uint8)
+        gray, channel, resized = self._buffers(frames.shape)
+        for group in range(len(gray)):
+            start = group * self.RESIZE_CHANNELS
+            block = frames[start:start + self.RESIZE_CHANNELS].transpose(1, 2, 0, 3)
+            n = block.shape[2]
+            # same float32 arithmetic as img[:, :, 0] * 0.299 + img[:, :, 1] * 0.587 + img[:, :, 2] * 0.114
+            np.multiply(block[..., 0], np.float32(0.299), out=gray[group, ..., :n])
+            np.multiply(block[..., 1], np.float32(0.587), out=channel[..., :n])
+            gray[group, ..., :n] += channel[..., :n]
+            np.multiply(block[..., 2], np.float32(0.114), out=channel[..., :n])
+            gray[group, ..., :n] += channel[..., :n]
+            cv2.resize(gray[group], (84, 110), dst=resized[group], interpolation=cv2.INTER_AREA)
+            np.copyto(out[start:start + n, :, :, 0], resized[group, 18:102, :, :n].transpose(2, 0, 1),
+                      casting="unsafe")
+        return out
+
+
 class ProcessFrame84(gym.ObservationWrapper):
+    preprocessor = FramePreprocessor()
+
     def __init__(self, env=None):
         super(ProcessFrame84, self).__init__(env)
         self.observation_space = gym.spaces.Box(low=0, high=255, shape=(84, 84, 1), dtype=np.uint8)
@@ -64,17 +126,19 @@ class ProcessFrame84(gym.ObservationWrapper):
 
     @staticmethod
     def process(frame):
-        if frame.size == 210 * 160 * 3:
-            img = np.reshape(frame, [210, 160, 3]).astype(np.float32)
-        elif frame.size == 250 * 160 * 3:
-            img = np.reshape(frame, [250, 160, 3]).astype(np.float32)
+        return ProcessFrame84.process_batch(np.asarray(frame)[np.newaxis])[0]
+
+    @staticmethod
+    def process_batch(frames):
+        """Preprocess (N, 210 or 250, 160, 3) frames, e.g. from vectorized envs, into (N, 84, 84, 1) uint8."""
+        frames = np.asarray(frames)
+        if frames[0].size == 210 * 160 * 3:
+            frames = np.reshape(frames, [len(frames), 210, 160, 3])
+        elif frames[0].size == 250 * 160 * 3:
+            frames = np.reshape(frames, [len(frames), 250, 160, 3])
         else:
             assert False, "Unknown resolution."
-        img = img[:, :, 0] * 0.299 + img[:, :, 1] * 0.587 + img[:, :, 2] * 0.114
-        resized_screen = cv2.resize(img, (84, 110), interpolation=cv2.INTER_AREA)
-        x_t = resized_screen[18:102, :]
-        x_t = np.reshape(x_t, [84, 84, 1])
-        return x_t.astype(np.uint8)
+        return ProcessFrame84.preprocessor(frames)
 
 
 class ImageToPyTorch(gym.ObservationWrapper):
@@ -93,22 +157,46 @@ class ScaledFloatFrame(gym.ObservationWrapper):
         return np.array(obs).astype(np.float32) / 255.0
 
 
+class LazyFrames:
+    def __init__(self, frames):
+        """Stack of the last frames, kept as references and only concatenated when an array is needed."""
+        self.frames = frames
+
+    def __array__(self, dtype=None, copy=None):
+        stacked = np.concatenate(self.frames, axis=0)
+        return stacked if dtype is None else stacked.astype(dtype)
+
+    def __len__(self):
+        return sum(len(frame) for frame in self.frames)
+
+    def __getitem__(self, index):
+        return np.asarray(self)[index]
+
+    @property
+    def shape(self):
+        return (len(self),) + self.frames[0].shape[1:]
+
+
 class BufferWrapper(gym.ObservationWrapper):
     def __init__(self, env, n_steps, dtype=np.float32):
+        """Stack the last n_steps observations; a ring of frame references replaces shifting the whole stack every step."""
         super(BufferWrapper, self).__init__(env)
         self.dtype = dtype
+        self.n_steps = n_steps
         old_space = env.observation_space
         self.observation_space = gym.spaces.Box(old_space.low.repeat(n_steps, axis=0),
                                                 old_space.high.repeat(n_steps, axis=0), dtype=dtype)
 
     def reset(self):
-        self.buffer = np.zeros_like(self.observation_space.low, dtype=self.dtype)
+        # the stack starts as zeros, as before, which all slots can share
+        empty_frame = np.zeros(self.env.observation_space.shape, dtype=self.dtype)
+        self.frames = collections.deque([empty_frame] * self.n_steps, maxlen=self.n_steps)
         return self.observation(self.env.reset())
 
     def observation(self, observation):
-        self.buffer[:-1] = self.buffer[1:]
-        self.buffer[-1] = observation
-        return self.buffer
+        # each stack returned holds its own references, so it never changes afterwards
+        self.frames.append(np.asarray(observation, dtype=self.dtype))
+        return LazyFrames(tuple(self.frames))
 
 
 def make_env(env_name):
@@ -118,4 +206,26 @@ def make_env(env_name):
     env = ProcessFrame84(env)
     env = ImageToPyTorch(env)
     env = BufferWrapper(env, 4)
-    return ScaledFloatFrame(env)
\ No newline at end of file
+    return ScaledFloatFrame(env)
+
+
+class DictToVector(gym.ObservationWrapper):
+    def __init__(self, env):
+        """Flatten a Dict of Discrete observations, e.g. the discrete lifecycle env, into a vector."""
+        super(DictToVector, self).__init__(env)
+        self.keys = list(env.observation_space.spaces.keys())
+        # the bounds are the values the env really emits, start to start + n - 1
+        spaces = [env.observation_space.spaces[key] for key in self.keys]
+        low = np.array([getattr(space, "start", 0) for space in spaces], dtype=np.float32)
+        high = low + np.array([space.n - 1 for space in spaces], dtype=np.float32)
+        self.observation_space = gym.spaces.Box(low=low, high=high, dtype=np.float32)
+
+    def reset(self):
+        return self.observation(self.env.reset())
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        return self.observation(obs), reward, done, info
+
+    def observation(self, observation):
+        return np.array([observation[key] for key in self.keys], dtype=np.float32)
@@ -0,0 +1,79 @@
+# load libraries
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DP_DIR = os.path.join(ROOT, "dynamic_programming")
+RL_DIR = os.path.join(ROOT, "reinforcement")
+
+# Checks of what a fresh interpreter imports for the CLI and the project modules, and of
+# how long it takes, against the per-start budgets of the startup benchmarks. Run it from
+# here: python -m pytest test_imports.py
+
+
+def _startup_budgets():
+    spec = importlib.util.spec_from_file_location("benchmarks_run", os.path.join(ROOT, "benchmarks", "run.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.STARTUP_BUDGETS
+
+
+def imported_modules(statement, directory):
+    # top-level packages a fresh interpreter imports to run statement, from -X importtime
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=directory,
+                            capture_output=True, text=True, check=True).stderr
+    modules = set()
+    for line in output.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            modules.add(name.split(".")[0])
+    return modules
+
+
+def start_time(command, directory, runs=3):
+    # best wall-clock time of a fresh interpreter running command, as the benchmark times it
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-W", "ignore"] + command, cwd=directory, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def test_lifecycle_import_is_light():
+    # quantecon is imported by the first solve, matplotlib and pandas only for plots and tables
+    modules = imported_modules("import lifecycle", DP_DIR)
+    assert "lifecycle" in modules
+    assert not modules & {"quantecon", "numba", "matplotlib", "pandas"}
+
+
+def test_evaluation_import_is_light():
+    modules = imported_modules("import evaluation", DP_DIR)
+    assert not modules & {"quantecon", "matplotlib", "pandas", "torch"}
+
+
+def test_dqn_import_skips_cv2_and_tensorboard():
+    # cv2 is only needed to preprocess Atari frames, tensorboardX only by the training run.
+    # gym's own wrappers import cv2 when it is installed, so I block it: importing dqn has
+    # to work without it
+    modules = imported_modules("import sys; sys.modules['cv2'] = None; import dqn", RL_DIR)
+    assert "dqn" in modules
+    assert "tensorboardX" not in modules
+
+
+def test_startup_within_budget():
+    budgets = _startup_budgets()
+    commands = {
+        "startup/cli": ([os.path.join(ROOT, "cli.py"), "--help"], ROOT),
+        "startup/lifecycle": (["-c", "import lifecycle"], DP_DIR),
+        "startup/evaluation": (["-c", "import evaluation"], DP_DIR),
+    }
+    assert set(commands) == set(budgets)
+    for name, (command, directory) in commands.items():
+        seconds = start_time(command, directory)
+        assert seconds < budgets[name], "%s took %.3f s, the budget is %.3f s" % (name, seconds, budgets[name])